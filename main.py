@@ -4,6 +4,7 @@ from __future__ import print_function
 
 import json
 import sys
+import random
 import numpy as np
 import os.path
 import time
@@ -36,9 +37,31 @@ if __name__ == "__main__":
     parser.add_argument('--placements', metavar="placements_file", dest="placements_file", help="Use this placements file rather than creating one. Must be previously generated from the supplied BLIF.")
     parser.add_argument('--routings', metavar="routings_file", dest="routings_file", help="Use this routings file rather than creating one. Must be previously generated from the supplied BLIF and placements JSON.")
     parser.add_argument('--world', metavar="world_folder", dest="world_folder", help="Place the extracted redstone circuit layout in this world.")
+    parser.add_argument('--placer-workers', metavar="workers", dest="placer_workers", type=int, default=1, help="Anneal this many chains at once (with replica exchange), each in its own process.")
+    parser.add_argument('--initial-placer', dest="initial_placer", choices=["grid", "analytical", "partition"], default="grid", help="Start annealing from cells in netlist order on a grid, or at a lower temperature from an analytical (quadratic wire length) placement or a recursive min-cut partitioning placement.")
+    parser.add_argument('--schedule', dest="schedule", choices=["fixed", "adaptive"], default="fixed", help="Cool by a fixed factor, or adapt the cooling rate, displacement window and stopping point to the fraction of moves accepted (single worker only).")
+    parser.add_argument('--move-batch', dest="move_batch", type=int, default=1, help="Number of non-interfering moves to evaluate at once while annealing with the fixed schedule (single worker only).")
+    parser.add_argument('--router', dest="router", choices=["rip-up", "negotiated"], default="rip-up", help="Re-route randomly chosen segments with violations, or re-route every segment while negotiating for congested locations (PathFinder).")
+    parser.add_argument('--router-workers', metavar="workers", dest="router_workers", type=int, default=1, help="Re-route segments whose search windows don't overlap at once, this many at a time, each in its own process (rip-up router only).")
+    parser.add_argument('--tree-routing', dest="tree_routing", action="store_true", help="Route each net as a tree, connecting each pin to the nearest wire already routed for its net, rather than pin to pin.")
+    parser.add_argument('--router-iterations', metavar="iterations", dest="router_iterations", type=int, help="Stop re-routing after this many iterations (100 for the negotiated router, unlimited otherwise).")
+    parser.add_argument('--router-time-limit', metavar="seconds", dest="router_time_limit", type=float, help="Stop re-routing after this many seconds (rip-up router only).")
+    parser.add_argument('--router-stagnation', metavar="iterations", dest="router_stagnation", type=int, help="Stop re-routing after this many iterations without fewer violations than the fewest so far (rip-up router only).")
+    parser.add_argument('--global-routing', dest="global_routing", action="store_true", help="Route segments over tiles of one placement grid interval first, and search for each within the corridor of tiles it was given.")
+    parser.add_argument('--seed', metavar="seed", dest="seed", type=int, help="Seed the random number generator, for reproducible results.")
 
     args = parser.parse_args()
 
+    # The parallel chains anneal with the fixed schedule, one move at a time
+    if args.placer_workers > 1 and args.schedule != "fixed":
+        parser.error("--schedule %s can't be used with --placer-workers above 1" % args.schedule)
+    if args.placer_workers > 1 and args.move_batch > 1:
+        parser.error("--move-batch can't be used with --placer-workers above 1")
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+
     # Load placements, if provided
     if args.placements_file is not None:
         print("Using placements file:", args.placements_file)
@@ -74,7 +97,10 @@ if __name__ == "__main__":
 
     pregenerated_cells = cell_library.pregenerate_cells(cell_lib, pad=1)
 
-    placer = placer.GridPlacer(blif, pregenerated_cells, grid_spacing=5)
+    if args.initial_placer == "partition":
+        placer = placer.PartitionPlacer(blif, pregenerated_cells, grid_spacing=5, workers=args.placer_workers)
+    else:
+        placer = placer.GridPlacer(blif, pregenerated_cells, grid_spacing=5)
 
     start_time = time.time()
     print("Started", time.strftime("%c", time.localtime(start_time)))
@@ -83,7 +109,13 @@ if __name__ == "__main__":
     if placements is None:
         underline_print("Performing Initial Placement...")
 
-        placements, dimensions = placer.initial_placement()
+        if args.initial_placer == "analytical":
+            placements, dimensions = placer.analytical_placement()
+        elif args.initial_placer == "partition":
+            seed = args.seed if args.seed is not None else random.randrange(2**32)
+            placements, dimensions = placer.partition_placement(seed=seed)
+        else:
+            placements, dimensions = placer.initial_placement()
 
         score = placer.score(placements, dimensions)
 
@@ -91,10 +123,22 @@ if __name__ == "__main__":
 
         underline_print("Doing Placement...")
 
-        # Place cells
-        T_0 = 250
+        # Place cells. An analytical or partitioning placement is already
+        # close to a good one, so it only needs to be annealed at low
+        # temperature.
+        T_0 = 250 if args.initial_placer == "grid" else 25
         iterations = 2000
-        new_placements = placer.simulated_annealing_placement(placements, dimensions, T_0, iterations)
+
+        # The adaptive schedule can pick its own starting temperature
+        if args.schedule == "adaptive" and args.initial_placer == "grid":
+            T_0 = None
+        if args.placer_workers > 1:
+            seed = args.seed if args.seed is not None else random.randrange(2**32)
+            new_placements, chain_stats = placer.parallel_annealing_placement(placements, dimensions, T_0, iterations, workers=args.placer_workers, seed=seed)
+            for k, stats in enumerate(chain_stats):
+                print("Chain {}: T={:.2f}  Best score: {}  Accepted: {}/{}  Exchanges: {}/{}".format(k, stats["T"], stats["best_score"], stats["accepted"], stats["proposed"], stats["exchanges_accepted"], stats["exchanges_proposed"]))
+        else:
+            new_placements = placer.simulated_annealing_placement(placements, dimensions, T_0, iterations, schedule=args.schedule, batch_size=args.move_batch)
 
         placements, dimensions = placer.shrink(new_placements)
 
@@ -132,9 +176,14 @@ if __name__ == "__main__":
     if routing is None:
         blocks, data = layout
         print("Doing initial routing...")
-        routing = router.initial_routing(placements, blocks.shape)
+        routing = router.initial_routing(placements, blocks.shape, blocks)
         print("done.")
-        routing = router.re_route(routing, layout)
+        tile_size = placer.interval if args.global_routing else None
+        if args.router == "negotiated":
+            iterations = args.router_iterations if args.router_iterations is not None else 100
+            routing = router.negotiated_route(routing, layout, iterations=iterations, tree=args.tree_routing, tile_size=tile_size)
+        else:
+            routing = router.re_route(routing, layout, workers=args.router_workers, tree=args.tree_routing, tile_size=tile_size, iterations=args.router_iterations, time_limit=args.router_time_limit, stagnation_limit=args.router_stagnation)
 
         # Preserve routing
         with open(os.path.join(result_dir, "routing.json"), "w") as f:
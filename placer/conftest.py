@@ -0,0 +1,94 @@
+from __future__ import print_function
+
+import os
+import random
+from collections import defaultdict
+
+import pytest
+
+from util import cell_library
+from util.blif import BLIF
+
+@pytest.fixture(scope="session")
+def pregenerated_cells():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "lib", "quan.yaml")
+    with open(path) as f:
+        return cell_library.pregenerate_cells(cell_library.load(f), pad=1)
+
+@pytest.fixture
+def random_blif(pregenerated_cells):
+    """
+    Returns a function making a BLIF of num_cells random cells of the
+    library, with their pins on num_nets random nets.
+    """
+    def make(num_cells, num_nets, seed):
+        rng = random.Random(seed)
+        names = sorted(pregenerated_cells)
+
+        cells = []
+        for _ in xrange(num_cells):
+            name = rng.choice(names)
+            ports = sorted(pregenerated_cells[name][0].ports)
+            cells.append({"name": name, "pins": dict((pin, "n%d" % rng.randrange(num_nets)) for pin in ports)})
+
+        return BLIF("test", [], [], [], cells, [])
+
+    return make
+
+@pytest.fixture
+def random_placements():
+    """
+    Returns a function placing every cell of a BLIF at a random anchor on
+    the grid of a placer, within dimensions and a little beyond, with a
+    random rotation.
+    """
+    def make(placer, blif, dimensions, seed):
+        rng = random.Random(seed)
+        _, width, length = dimensions
+
+        placements = []
+        for cell in blif.cells:
+            z = rng.randrange(-2 * placer.interval, width + 2 * placer.interval)
+            x = rng.randrange(-2 * placer.interval, length + 2 * placer.interval)
+            placements.append({"name": cell["name"],
+                               "placement": list(placer.snap_to_grid([0, z, x])),
+                               "turns": rng.randrange(4),
+                               "pins": cell["pins"]})
+
+        return placements
+
+    return make
+
+@pytest.fixture
+def reference_score(pregenerated_cells):
+    """
+    Returns a function scoring placements the plain way, cell by cell:
+    the half-perimeter wire length of every net, plus every cell in excess
+    of one at a location, plus every location of a cell outside
+    dimensions.
+    """
+    def score(placements, dimensions):
+        net_pins = defaultdict(list)
+        occupancy = defaultdict(int)
+
+        for placement in placements:
+            cell = pregenerated_cells[placement["name"]][placement["turns"]]
+            yy, zz, xx = placement["placement"]
+
+            for pin, net in placement["pins"].iteritems():
+                (y, z, x) = cell.ports[pin]["coordinates"]
+                net_pins[net].append((y + yy, z + zz, x + xx))
+
+            h, w, l = cell.blocks.shape
+            for y in xrange(yy, yy + h):
+                for z in xrange(zz, zz + w):
+                    for x in xrange(xx, xx + l):
+                        occupancy[(y, z, x)] += 1
+
+        wire_length = sum(max(c[k] for c in pins) - min(c[k] for c in pins) for pins in net_pins.itervalues() for k in xrange(3))
+        overlap = sum(count - 1 for count in occupancy.itervalues() if count > 1)
+        out_of_bounds = sum(count for coord, count in occupancy.iteritems() if not all(0 <= c < d for c, d in zip(coord, dimensions)))
+
+        return wire_length + overlap + out_of_bounds
+
+    return score
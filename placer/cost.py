@@ -0,0 +1,283 @@
+from __future__ import print_function
+
+import numpy as np
+
+from occupancy import OccupancyGrid
+
+class IncrementalCost(object):
+    """
+    IncrementalCost tracks the score of a placement (as computed by
+    Placer.score) while cells are moved around, so that each move only
+    costs as much as the cells and nets it touches.
+
+    The PlacementStore given to the constructor is owned by this object
+    afterwards: move() and undo() modify it in place. Its cells must be in
+    the same order as the cells of the placer's NetIndex.
+
+    Each net keeps its bounding box, along with the number of pins lying on
+    each of its faces, so that moving a pin only rescans the pins of a net
+    when the last pin on a face moves inwards.
+    """
+    def __init__(self, placer, store, dimensions):
+        if len(store) != len(placer.netlist.cell_pins):
+            raise ValueError("Placement has {} cells, but the netlist has {}".format(len(store), len(placer.netlist.cell_pins)))
+
+        self.cell_rotations = placer.cell_rotations
+        self.cell_footprints = placer.cell_footprints
+        self.cell_shapes = placer.cell_shapes
+        self.netlist = placer.netlist
+        self.scorer = placer.scorer
+        self.store = store
+        self.dimensions = dimensions
+
+        self.grid = OccupancyGrid(dimensions)
+
+        for i in xrange(len(store)):
+            self.grid.add(self.store.anchor(i), self.lookup_footprint(i))
+
+        # (y, z, x) of each pin of the netlist
+        self.pin_coords = [None] * len(self.netlist.pin_cells)
+        for i in xrange(len(store)):
+            for p, coord in self.locate_cell_pins(i):
+                self.pin_coords[p] = coord
+
+        # Bounding box of each net, and the number of pins on each face
+        self.box_lo = []
+        self.box_hi = []
+        self.count_lo = []
+        self.count_hi = []
+        self.net_lengths = []
+
+        for n in xrange(len(self.netlist)):
+            self.box_lo.append([0, 0, 0])
+            self.box_hi.append([0, 0, 0])
+            self.count_lo.append([0, 0, 0])
+            self.count_hi.append([0, 0, 0])
+            for k in xrange(3):
+                self.rescan(n, k)
+            self.net_lengths.append(self.compute_net_length(n))
+
+        self.wire_length_penalty = sum(self.net_lengths)
+
+    @property
+    def score(self):
+        return self.wire_length_penalty + self.grid.overlap_penalty + self.grid.oob_penalty
+
+    def lookup_cell(self, i):
+        return self.cell_rotations[self.store.cell_types[i]][self.store.turns[i]]
+
+    def lookup_footprint(self, i):
+        return self.cell_footprints[self.store.cell_types[i]][self.store.turns[i]]
+
+    def locate_cell_pins(self, i):
+        """
+        Returns (pin index, (y, z, x)) for each pin of cell i.
+        """
+        ports = self.lookup_cell(i).ports
+        yy, zz, xx = self.store.anchor(i)
+
+        located = []
+        for p in self.netlist.cell_pins[i]:
+            (y, z, x) = ports[self.netlist.pin_names[p]]["coordinates"]
+            located.append((p, (y + yy, z + zz, x + xx)))
+
+        return located
+
+    def rescan(self, n, k):
+        """
+        Recompute the extent of net n along axis k from all of its pins.
+        """
+        values = [self.pin_coords[p][k] for p in self.netlist.net_pins[n]]
+        lo = min(values)
+        hi = max(values)
+
+        self.box_lo[n][k] = lo
+        self.box_hi[n][k] = hi
+        self.count_lo[n][k] = values.count(lo)
+        self.count_hi[n][k] = values.count(hi)
+
+    def compute_net_length(self, n):
+        lo = self.box_lo[n]
+        hi = self.box_hi[n]
+        return (hi[0] - lo[0]) + (hi[1] - lo[1]) + (hi[2] - lo[2])
+
+    def move_net_pin(self, n, old, new):
+        """
+        Update the bounding box of net n for one of its pins moving from
+        old to new.
+        """
+        lo, hi = self.box_lo[n], self.box_hi[n]
+        count_lo, count_hi = self.count_lo[n], self.count_hi[n]
+
+        for k in xrange(3):
+            o, v = old[k], new[k]
+            if o == v:
+                continue
+
+            # Take the pin off the faces it was on...
+            if o == lo[k]:
+                count_lo[k] -= 1
+            if o == hi[k]:
+                count_hi[k] -= 1
+
+            # ...and put it back where it is now
+            if v < lo[k]:
+                lo[k], count_lo[k] = v, 1
+            elif v == lo[k]:
+                count_lo[k] += 1
+
+            if v > hi[k]:
+                hi[k], count_hi[k] = v, 1
+            elif v == hi[k]:
+                count_hi[k] += 1
+
+            # The last pin on a face moved inwards
+            if count_lo[k] == 0 or count_hi[k] == 0:
+                self.rescan(n, k)
+
+        new_length = self.compute_net_length(n)
+        self.wire_length_penalty += new_length - self.net_lengths[n]
+        self.net_lengths[n] = new_length
+
+    def update_pins(self, i):
+        """
+        Move the pins of cell i to where the cell is now.
+        """
+        for p, coord in self.locate_cell_pins(i):
+            old = self.pin_coords[p]
+            if old != coord:
+                self.pin_coords[p] = coord
+                self.move_net_pin(self.netlist.pin_nets[p], old, coord)
+
+    def move(self, changes):
+        """
+        Move each cell i in changes, a list of (i, anchor, turns), update
+        the penalties of everything it touches and return the new score.
+
+        The move is kept until the next call to move(), unless reverted
+        with undo().
+        """
+        self.store.commit()
+
+        for i, _, _ in changes:
+            self.grid.remove(self.store.anchor(i), self.lookup_footprint(i))
+
+        for i, anchor, turns in changes:
+            self.store.move(i, anchor, turns)
+
+        for i, _, _ in changes:
+            self.grid.add(self.store.anchor(i), self.lookup_footprint(i))
+            self.update_pins(i)
+
+        return self.score
+
+    def undo(self):
+        """
+        Revert the last move.
+        """
+        moved = self.store.moved_cells()
+
+        for i in moved:
+            self.grid.remove(self.store.anchor(i), self.lookup_footprint(i))
+
+        self.store.undo()
+
+        for i in moved:
+            self.grid.add(self.store.anchor(i), self.lookup_footprint(i))
+            self.update_pins(i)
+
+    def evaluate_moves(self, candidates):
+        """
+        Returns an array of the change in score that each move in
+        candidates (each a list of (i, anchor, turns), as for move()) would
+        make if it were the only one made, without making any of them.
+
+        No two moves may change the same cell, or cells on the same net.
+        Their changes in wire length are then independent of each other,
+        although their changes in overlap are not if their footprints meet.
+        """
+        scorer = self.scorer
+        store = self.store
+        num_moves = len(candidates)
+
+        move_ids = []
+        cells = []
+        new_anchors = []
+        new_turns = []
+        for k, changes in enumerate(candidates):
+            for i, anchor, turns in changes:
+                move_ids.append(k)
+                cells.append(i)
+                new_anchors.append(anchor)
+                new_turns.append(turns)
+
+        move_ids = np.array(move_ids, dtype=np.int)
+        cells = np.array(cells, dtype=np.int)
+        new_anchors = np.array(new_anchors, dtype=np.int).reshape((len(cells), 3))
+        new_turns = np.array(new_turns, dtype=np.int)
+
+        # The placement with every move made
+        anchors = store.anchors.copy()
+        turns = store.turns.copy()
+        anchors[cells] = new_anchors
+        turns[cells] = new_turns
+
+        # Nets of the moved cells, and the move they belong to
+        net_moves = {}
+        for k, i in zip(move_ids.tolist(), cells.tolist()):
+            for n in self.netlist.cell_nets[i]:
+                net_moves[n] = k
+        nets = np.array(net_moves.keys(), dtype=np.int)
+        net_move_ids = np.array(net_moves.values(), dtype=np.int)
+
+        deltas = np.zeros(num_moves)
+
+        if len(nets):
+            # Every pin of those nets, net after net
+            counts = scorer.net_counts[nets]
+            segment_starts = np.cumsum(counts) - counts
+            ranks = np.repeat(scorer.net_starts[nets] - segment_starts, counts) + np.arange(counts.sum())
+            pins = scorer.pin_order[ranks]
+            pin_cells = scorer.pin_cells[ranks]
+
+            coords = anchors[pin_cells] + scorer.pin_offsets[pins, turns[pin_cells]]
+            lengths = (np.maximum.reduceat(coords, segment_starts) - np.minimum.reduceat(coords, segment_starts)).sum(axis=1)
+            old_lengths = np.array([self.net_lengths[n] for n in nets.tolist()], dtype=np.int)
+
+            deltas += np.bincount(net_move_ids, weights=lengths - old_lengths, minlength=num_moves)
+
+        # Take each moved cell's footprint out of where it is and put it
+        # where it goes
+        cell_types = store.cell_types[cells]
+        self.grid.ensure_contains(new_anchors.min(axis=0), (new_anchors + self.cell_shapes[cell_types, new_turns]).max(axis=0))
+        grid = self.grid.grid
+        strides = np.array([grid.shape[1] * grid.shape[2], grid.shape[2], 1])
+
+        keys = []
+        signs = []
+        for cell_anchors, cell_turns, sign in [(store.anchors[cells], store.turns[cells], -1), (new_anchors, new_turns, 1)]:
+            kinds = cell_types * 4 + cell_turns
+            for kind in np.unique(kinds):
+                selected = kinds == kind
+                offsets = scorer.footprint_coords[kind // 4][kind % 4].dot(strides)
+                locations = (cell_anchors[selected] - self.grid.origin).dot(strides)[:, None] + offsets[None, :]
+                keys.append((move_ids[selected][:, None] * grid.size + locations).ravel())
+                signs.append(np.repeat(sign, locations.size))
+
+        # Net change in the number of cells at each location, per move
+        keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        changes = np.bincount(inverse, weights=np.concatenate(signs)).astype(np.int)
+        location_moves = keys // grid.size
+        locations = keys % grid.size
+
+        before = grid.ravel()[locations]
+        after = before + changes
+        overlap_deltas = np.maximum(after - 1, 0) - np.maximum(before - 1, 0)
+
+        coords = np.array(np.unravel_index(locations, grid.shape)).T + self.grid.origin
+        outside = ((coords < 0) | (coords >= self.grid.dimensions)).any(axis=1)
+        oob_deltas = changes * outside
+
+        deltas += np.bincount(location_moves, weights=overlap_deltas + oob_deltas, minlength=num_moves)
+
+        return deltas.astype(np.int)
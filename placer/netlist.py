@@ -0,0 +1,44 @@
+from __future__ import print_function
+
+class NetIndex(object):
+    """
+    NetIndex maps the nets of a list of cells (each a dictionary with a
+    "pins" dictionary, as in BLIF.cells) to the cell pins attached to them,
+    and each cell to its nets.
+
+    Every cell pin is given an index. For pin index p:
+    - pin_cells[p] is the index of its cell
+    - pin_names[p] is the name of the pin on that cell, e.g. "A"
+    - pin_nets[p] is the index of its net in net_names
+
+    cell_pins[i] and net_pins[n] list the pin indices of cell i and net n,
+    and cell_nets[i] lists the (distinct) nets of cell i.
+    """
+    def __init__(self, cells):
+        self.net_names = sorted(set(net for cell in cells for net in cell["pins"].itervalues()))
+        self.net_ids = dict((net, n) for n, net in enumerate(self.net_names))
+
+        self.pin_cells = []
+        self.pin_names = []
+        self.pin_nets = []
+
+        self.cell_pins = [[] for _ in cells]
+        self.cell_nets = [[] for _ in cells]
+        self.net_pins = [[] for _ in self.net_names]
+
+        for i, cell in enumerate(cells):
+            for pin, net in sorted(cell["pins"].iteritems()):
+                p = len(self.pin_cells)
+                n = self.net_ids[net]
+
+                self.pin_cells.append(i)
+                self.pin_names.append(pin)
+                self.pin_nets.append(n)
+
+                self.cell_pins[i].append(p)
+                self.net_pins[n].append(p)
+                if n not in self.cell_nets[i]:
+                    self.cell_nets[i].append(n)
+
+    def __len__(self):
+        return len(self.net_names)
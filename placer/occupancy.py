@@ -0,0 +1,103 @@
+from __future__ import print_function
+
+import numpy as np
+
+class OccupancyGrid(object):
+    """
+    OccupancyGrid counts the number of cells occupying each location of a
+    layout. The grid only covers the locations cells have been added to,
+    padded by a margin on every side, and grows if a cell is added beyond
+    the margin.
+
+    Footprints are 0/1 integer matrices of the same shape as the cell they
+    belong to, and are added or removed at the cell's (y, z, x) anchor.
+
+    The overlap penalty (the number of cells in excess of one at every
+    location) and the out-of-bounds penalty (the number of occupied
+    locations outside of dimensions) are kept up to date as footprints are
+    added and removed.
+    """
+    def __init__(self, dimensions, margin=16):
+        self.dimensions = np.array(dimensions, dtype=np.int)
+        self.margin = margin
+
+        # Layout coordinate of grid[0, 0, 0]
+        self.origin = np.zeros(3, dtype=np.int)
+        self.grid = np.zeros((0, 0, 0), dtype=np.int32)
+
+        self.overlap_penalty = 0
+        self.oob_penalty = 0
+
+    def ensure_contains(self, lo, hi):
+        """
+        Grow the grid, if needed, so that it covers the layout coordinates
+        lo (inclusive) to hi (exclusive).
+        """
+        lo = np.asarray(lo)
+        hi = np.asarray(hi)
+        grid_hi = self.origin + self.grid.shape
+
+        if (lo >= self.origin).all() and (hi <= grid_hi).all():
+            return
+
+        if self.grid.size == 0:
+            self.origin = lo - self.margin
+            self.grid = np.zeros(hi - lo + 2 * self.margin, dtype=self.grid.dtype)
+            return
+
+        # Grow by half again along each axis that is too small, so that
+        # adding many cells is not quadratic
+        growth = np.maximum(self.margin, np.array(self.grid.shape) // 2)
+        new_origin = np.where(lo < self.origin, np.minimum(self.origin - growth, lo - self.margin), self.origin)
+        new_hi = np.where(hi > grid_hi, np.maximum(grid_hi + growth, hi + self.margin), grid_hi)
+
+        new_grid = np.zeros(new_hi - new_origin, dtype=self.grid.dtype)
+        (y, z, x) = self.origin - new_origin
+        (h, w, l) = self.grid.shape
+        new_grid[y:y+h, z:z+w, x:x+l] = self.grid
+
+        self.origin = new_origin
+        self.grid = new_grid
+
+    def footprint_slice(self, anchor, footprint):
+        anchor = np.asarray(anchor)
+        self.ensure_contains(anchor, anchor + footprint.shape)
+
+        (y, z, x) = anchor - self.origin
+        (h, w, l) = footprint.shape
+        return self.grid[y:y+h, z:z+w, x:x+l]
+
+    def count_out_of_bounds(self, anchor, footprint):
+        """
+        Returns the number of occupied locations of footprint, placed at
+        anchor, that fall outside the layout dimensions.
+        """
+        anchor = np.asarray(anchor)
+        lo = np.clip(-anchor, 0, footprint.shape)
+        hi = np.clip(self.dimensions - anchor, lo, footprint.shape)
+        (ly, lz, lx) = lo
+        (hy, hz, hx) = hi
+
+        return footprint.sum() - footprint[ly:hy, lz:hz, lx:hx].sum()
+
+    def add(self, anchor, footprint):
+        """
+        Add a footprint at anchor.
+        """
+        region = self.footprint_slice(anchor, footprint)
+
+        self.overlap_penalty += np.count_nonzero(region[footprint > 0])
+        self.oob_penalty += self.count_out_of_bounds(anchor, footprint)
+
+        region += footprint
+
+    def remove(self, anchor, footprint):
+        """
+        Remove a footprint previously added at anchor.
+        """
+        region = self.footprint_slice(anchor, footprint)
+
+        region -= footprint
+
+        self.overlap_penalty -= np.count_nonzero(region[footprint > 0])
+        self.oob_penalty -= self.count_out_of_bounds(anchor, footprint)
@@ -0,0 +1,144 @@
+from __future__ import print_function
+
+import random
+
+from collections import defaultdict
+
+def bisect(cells, balance=0.1, passes=10, rng=random):
+    """
+    Split cells into two halves cutting as few nets as possible, using
+    Fiduccia-Mattheyses passes from a random initial split.
+
+    cells is a list of cells, each a dictionary with a "pins" dictionary
+    as in BLIF.cells. Each half holds between (0.5 - balance) and
+    (0.5 + balance) of the cells.
+
+    Returns two lists of indices into cells.
+    """
+    n = len(cells)
+
+    # Nets with at least two cells among these cells
+    net_members = defaultdict(set)
+    for i, cell in enumerate(cells):
+        for net in cell["pins"].itervalues():
+            net_members[net].add(i)
+    nets = [sorted(members) for _, members in sorted(net_members.iteritems()) if len(members) > 1]
+
+    cell_nets = [[] for _ in xrange(n)]
+    for e, members in enumerate(nets):
+        for i in members:
+            cell_nets[i].append(e)
+
+    order = range(n)
+    rng.shuffle(order)
+    side = [0] * n
+    for i in order[n // 2:]:
+        side[i] = 1
+
+    min_size = max(1, int(n * (0.5 - balance)))
+
+    for _ in xrange(passes):
+        # Number of cells of each net on each side
+        counts = [[0, 0] for _ in nets]
+        for e, members in enumerate(nets):
+            for i in members:
+                counts[e][side[i]] += 1
+
+        # Cut nets saved by moving each cell to the other side
+        gains = [0] * n
+        for i in xrange(n):
+            s = side[i]
+            for e in cell_nets[i]:
+                if counts[e][s] == 1:
+                    gains[i] += 1
+                if counts[e][1 - s] == 0:
+                    gains[i] -= 1
+
+        # Free cells of each side, bucketed by gain
+        buckets = [defaultdict(set), defaultdict(set)]
+        for i in xrange(n):
+            buckets[side[i]][gains[i]].add(i)
+
+        locked = [False] * n
+        sizes = [side.count(0), side.count(1)]
+
+        def adjust(i, delta):
+            bucket = buckets[side[i]]
+            bucket[gains[i]].discard(i)
+            if not bucket[gains[i]]:
+                del bucket[gains[i]]
+            gains[i] += delta
+            bucket[gains[i]].add(i)
+
+        moves = []
+        total_gain = 0
+        best_gain = 0
+        best_length = 0
+
+        while True:
+            # Pick the free cell with the highest gain whose move keeps
+            # the split balanced
+            candidates = []
+            for s in [0, 1]:
+                if sizes[s] - 1 >= min_size and buckets[s]:
+                    g = max(buckets[s])
+                    candidates.append((g, s))
+            if not candidates:
+                break
+
+            g, s = max(candidates)
+            i = min(buckets[s][g])
+            t = 1 - s
+
+            buckets[s][g].discard(i)
+            if not buckets[s][g]:
+                del buckets[s][g]
+            locked[i] = True
+
+            for e in cell_nets[i]:
+                members = nets[e]
+
+                # Before the move, looking at the side it goes to
+                if counts[e][t] == 0:
+                    for j in members:
+                        if not locked[j]:
+                            adjust(j, 1)
+                elif counts[e][t] == 1:
+                    for j in members:
+                        if not locked[j] and side[j] == t:
+                            adjust(j, -1)
+
+                counts[e][s] -= 1
+                counts[e][t] += 1
+
+                # After the move, looking at the side it came from
+                if counts[e][s] == 0:
+                    for j in members:
+                        if not locked[j]:
+                            adjust(j, -1)
+                elif counts[e][s] == 1:
+                    for j in members:
+                        if not locked[j] and side[j] == s:
+                            adjust(j, 1)
+
+            side[i] = t
+            sizes[s] -= 1
+            sizes[t] += 1
+
+            moves.append(i)
+            total_gain += g
+            if total_gain > best_gain:
+                best_gain = total_gain
+                best_length = len(moves)
+
+        # Roll back to the best point of the pass
+        for i in moves[best_length:]:
+            side[i] = 1 - side[i]
+
+        if best_gain <= 0:
+            break
+
+    left = [i for i in xrange(n) if side[i] == 0]
+    right = [i for i in xrange(n) if side[i] == 1]
+
+    return left, right
@@ -3,18 +3,43 @@ from __future__ import print_function
 import sys
 import random
 import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import spsolve
 
 from collections import defaultdict
-from copy import deepcopy
 from math import exp, log, sqrt, ceil
+from multiprocessing import Pool
 
+from util.blif import BLIF
 from util.blocks import block_names
 from vis import png
 
+from cost import IncrementalCost
+from netlist import NetIndex
+from partition import bisect
+from scoring import BatchScorer
+from store import PlacementStore
+
 class Placer(object):
     def __init__(self, blif, pregenerated_cells):
         self.blif = blif
         self.pregenerated_cells = pregenerated_cells
+        self.netlist = NetIndex(blif.cells)
+
+        # Cell types as indexed by a PlacementStore, with the rotations and
+        # (height, width, length) of each
+        self.cell_names = sorted(pregenerated_cells)
+        self.cell_rotations = [pregenerated_cells[name] for name in self.cell_names]
+        self.cell_shapes = np.array([[cell.blocks.shape for cell in rotations] for rotations in self.cell_rotations], dtype=np.int)
+
+        # Every location of a cell's bounding box counts as occupied
+        self.cell_footprints = [[np.ones(cell.blocks.shape, dtype=np.int32) for cell in rotations] for rotations in self.cell_rotations]
+
+        self.scorer = BatchScorer(self)
+
+        # Only the first num_movable cells of a placement are moved while
+        # annealing (every cell if None); the rest stay where they are
+        self.num_movable = None
 
     def compute_max_cell_dimension(self):
         # Estimate the width by taking the maximum of X or Z of all cells
@@ -25,6 +50,30 @@ class Placer(object):
 
         return max_cell_width
 
+    def check_dimensions(self, dimensions, spacing=5):
+        """
+        Returns dimensions, or if it is None, an educated guess at the
+        dimensions based on the cells used.
+        """
+        if dimensions is None:
+            cells = [self.pregenerated_cells[bc["name"]][0] for bc in self.blif.cells]
+
+            max_height = max(cell.blocks.shape[0] for cell in cells)
+
+            max_cell_width = self.compute_max_cell_dimension()
+
+            # Add up the longest dimension, plus one for each cell
+            width_estimate = (len(cells) * (max_cell_width + spacing))
+
+            dimensions = (max_height, width_estimate, width_estimate)
+
+            print("Estimating dimensions to be {}".format(dimensions))
+        else:
+            if len(dimensions) != 3:
+                raise ValueError("Dimensions ({}) is not a tuple of length 3".format(dimensions))
+
+        return dimensions
+
     def initial_placement(self, dimensions=None):
         """
         Generate an initial stupid placement of cells.
@@ -53,20 +102,9 @@ class Placer(object):
         # Generate the square root (to place them in a square as best as possible
         num_cells_side = int(ceil(sqrt(len(cells))))
 
-        max_height = max(cell.blocks.shape[0] for cell in cells)
-
         max_cell_width = self.compute_max_cell_dimension()
 
-        # Add up the longest dimension, plus one for each cell
-        width_estimate = (len(cells) * (max_cell_width + spacing))
-
-        if dimensions is None:
-            dimensions = (max_height, width_estimate, width_estimate)
-
-            print("Estimating dimensions to be {}".format(dimensions))
-        else:
-            if len(dimensions) != 3:
-                raise ValueError("Dimensions ({}) is not a tuple of length 3".format(dimensions))
+        dimensions = self.check_dimensions(dimensions, spacing)
 
         # Lay them out on a grid
         anchor = [0, 0, 0]
@@ -118,102 +156,46 @@ class Placer(object):
         f = lambda x: x["name"] in ["input_pin", "output_pin"]
         return self.locate_pins(placements, f)
 
-    def estimate_lengths_and_occupieds(self, placements):
-        net_pins = defaultdict(list)
-        grid = defaultdict(int)
-
-        for blif_cell, placement in zip(self.blif.cells, placements):
-            # Do the cell lookup
-            rotation = placement["turns"]
-            cell_name = placement["name"]
-            cell = self.pregenerated_cells[cell_name][rotation]
-
-            yy, zz, xx = placement["placement"]
-            height, width, length = cell.blocks.shape
-
-            # Add all items in this 3D matrix by the value 1
-            for y in xrange(height):
-                for z in xrange(width):
-                    for x in xrange(length):
-                        coord = (yy + y, zz + z, xx + x)
-                        grid[coord] += 1
-
-            # Add the pins
-            for pin, d in cell.ports.iteritems():
-                (y, z, x) = d["coordinates"]
-                coord = (y + yy, z + zz, x + xx)
-                net_name = placement["pins"][pin]
-                net_pins[net_name].append(coord)
-
-        net_lengths = {}
-
-        # Figure the point-to-point of these pins' locations
-        for net, pins in net_pins.iteritems():
-            dy = max(c[0] for c in pins) - min(c[0] for c in pins)
-            dz = max(c[1] for c in pins) - min(c[1] for c in pins)
-            dx = max(c[2] for c in pins) - min(c[2] for c in pins)
-
-            net_lengths[net] = dy + dz + dx
-
-        # print(net_lengths)
-
-        return net_lengths, grid
-
-
-    def compute_occupied_locations(self, placements, dimensions):
-
-        grid = defaultdict(int)
-
-        for placement in placements:
-            # Do the cell lookup
-            rotation = placement["turns"]
-            cell_name = placement["name"]
-            cell = self.pregenerated_cells[cell_name][rotation]
+    def window_extent(self, dimensions, scaling_factor):
+        """
+        Returns how far in Z and X a cell may move within a window of the
+        given scaling_factor (between 0 and 1) of its largest size.
+        """
+        return (max(2, int(np.round(dimensions[1] * scaling_factor))),
+                max(2, int(np.round(dimensions[2] * scaling_factor))))
 
-            yy, zz, xx = placement["placement"]
+    def displace(self, coord, T, T_0, dimensions, scaling_factor=None):
+        """
+        Pick a new anchor for a cell currently at coord, from a window that
+        shrinks as the temperature T drops from T_0.
 
-            for y in xrange(cell.blocks.shape[0]):
-                for z in xrange(cell.blocks.shape[1]):
-                    for x in xrange(cell.blocks.shape[2]):
-                        if cell.blocks[y, z, x] > 0:
-                            grid[(yy + y, zz + z, xx + x)] += 1
+        scaling_factor, between 0 and 1, overrides the size of the window
+        relative to its largest size.
+        """
+        if scaling_factor is None:
+            scaling_factor = log(T) / log(T_0)
 
-        # print(grid)
+        window_half_height, window_half_width = self.window_extent(dimensions, scaling_factor)
 
-        return grid
+        # print("Window width:", window_half_width * 2)
+        # print("Window height:", window_half_height * 2)
 
-    def compute_bounds_penalty(self, grid, dimensions):
-        penalty = 0
-        for coord, v in grid.iteritems():
-            y, z, x = coord
-            if y < 0 or y >= dimensions[0] or \
-               z < 0 or z >= dimensions[1] or \
-               x < 0 or x >= dimensions[2]:
-                penalty += v
+        old_y, window_center_z, window_center_x = coord
 
-        return penalty
+        # Select new X and Z from window
+        new_x = random.randint(window_center_x - window_half_width, window_center_x + window_half_width)
+        new_z = random.randint(window_center_z - window_half_height, window_center_z + window_half_height)
 
-    def compute_overlap_penalty(self, grid):
-        """
-        Given a grid that trocks the number of cells that occupy a given
-        coordinate, compute a penalty.
+        return [old_y, new_z, new_x]
 
-        Obviously, locations with no cells or one cell are not penalized.
-        However, if there is more than one cell, penalize by the amount in
-        excess of one cell.
+    def propose_move(self, store, T, T_0, dimensions, method="displace", displace_interchange_ratio=5, window=None):
         """
+        Choose a move that either switches the location of two cells,
+        displaces a cell or rotates it, without modifying the PlacementStore
+        store.
 
-        penalty = 0
-        for coord, v in grid.iteritems():
-            if v > 1:
-                penalty += (v - 1)
-
-        return penalty
-
-    def generate(self, old_placements, T, T_0, dimensions, method="displace", displace_interchange_ratio=5):
-        """
-        Given an old placement, generate a new placement by either switching
-        the location of two cells or displacing a cell or rotating it.
+        Returns the move as a list of (cell index, new anchor, new turns)
+        for each cell it changes, along with the method used.
 
         T is the current temperature; T_0 is the starting temperature. This
         is used to scale the window for displacing a cell.
@@ -222,61 +204,93 @@ class Placer(object):
 
         displace_interchange_ratio is the ratio of how often you displace
         a cell and how often you interchange it with another cell.
+
+        window is the scaling_factor passed on to displace(). If it is
+        given, cells are also only interchanged with cells within the
+        window around them (see window_extent()).
+
+        Only the first num_movable cells are chosen.
         """
-        new_placements = deepcopy(old_placements)
+        num_movable = len(store) if self.num_movable is None else self.num_movable
 
         # Select a random cell to interchange, displace, or orient
-        cellA = random.choice(new_placements)
+        a = random.randrange(num_movable)
+        anchor_a, turns_a = store.anchor(a), store.turns[a]
 
-        method_used = ""
+        interchange = num_movable > 1 and random.random() > (1. / displace_interchange_ratio)
 
-        interchange = random.random() > (1. / displace_interchange_ratio)
-        if interchange:
-            cellB = cellA
-            while cellB is cellA:
-                cellB = random.choice(new_placements)
+        # The cells a may be interchanged with
+        partners = None
+        if interchange and window is not None:
+            half_z, half_x = self.window_extent(dimensions, window)
+            offsets = np.abs(store.anchors[:num_movable, 1:] - store.anchors[a, 1:])
+            partners = np.flatnonzero((offsets[:, 0] <= half_z) & (offsets[:, 1] <= half_x))
+            partners = partners[partners != a]
+            interchange = len(partners) > 0
 
-            # print("Interchanging {} (at {}) with {} (at {})".format(cellA["name"], cellA["placement"], cellB["name"], cellB["placement"]))
-            cellA["placement"], cellB["placement"] = cellB["placement"], cellA["placement"]
+        if interchange:
+            if partners is not None:
+                b = int(partners[random.randrange(len(partners))])
+            else:
+                b = a
+                while b == a:
+                    b = random.randrange(num_movable)
+            anchor_b, turns_b = store.anchor(b), store.turns[b]
+
+            # print("Interchanging {} (at {}) with {} (at {})".format(store.name(a), anchor_a, store.name(b), anchor_b))
+            changes = [(a, anchor_b, turns_a),
+                       (b, anchor_a, turns_b)]
             method_used = "interchange"
         else: # displace or reorient
             if method == "displace":
-                scaling_factor = log(T) / log(T_0)
-
-                window_half_height = max(2, np.round(dimensions[1] * scaling_factor))
-                window_half_width = max(2, np.round(dimensions[2] * scaling_factor))
-
-                # print("Window width:", window_half_width * 2)
-                # print("Window height:", window_half_height * 2)
-
-                old_y, window_center_z, window_center_x = cellA["placement"]
-
-                # Select new X and Z from window
-                new_x = random.randint(window_center_x - window_half_width, window_center_x + window_half_width)
-                new_z = random.randint(window_center_z - window_half_height, window_center_z + window_half_height)
-
-                cellA["placement"] = [old_y, new_z, new_x]
+                new_coord = self.displace(anchor_a, T, T_0, dimensions, window)
+                changes = [(a, new_coord, turns_a)]
                 method_used = "displace"
 
             elif method == "reorient":
                 # Rotate 90 degrees
-                cellA["turns"] = (cellA["turns"] + 1) % 4
+                changes = [(a, anchor_a, (turns_a + 1) % 4)]
                 method_used = "reorient"
 
             else:
                 raise ValueError("Method must be 'displace' or 'reorient'")
 
-        return new_placements, method_used
+        return changes, method_used
 
+    def propose_moves(self, store, count, T, T_0, dimensions, method="displace", window=None):
+        """
+        Choose up to count moves, as with propose_move(), no two of which
+        change the same cell or cells on the same net, so that they can be
+        evaluated together by IncrementalCost.evaluate_moves().
 
-    def score(self, placements, dimensions):
-        estimated_net_lengths, occupied = self.estimate_lengths_and_occupieds(placements)
+        Returns a list of (changes, method used).
+        """
+        cell_nets = self.netlist.cell_nets
 
-        wire_length_penalty = sum(estimated_net_lengths.values())
-        overlap_penalty = self.compute_overlap_penalty(occupied)
-        oob_penalty = self.compute_bounds_penalty(occupied, dimensions)
+        used_cells = set()
+        used_nets = set()
+        moves = []
 
-        return wire_length_penalty + overlap_penalty + oob_penalty
+        for _ in xrange(2 * count):
+            changes, method_used = self.propose_move(store, T, T_0, dimensions, method, window=window)
+
+            cells = [i for i, _, _ in changes]
+            nets = [n for i in cells for n in cell_nets[i]]
+            if used_cells.intersection(cells) or used_nets.intersection(nets):
+                continue
+
+            used_cells.update(cells)
+            used_nets.update(nets)
+            moves.append((changes, method_used))
+
+            if len(moves) == count:
+                break
+
+        return moves
+
+    def score(self, placements, dimensions):
+        store = PlacementStore.from_placements(placements, self.cell_names)
+        return self.scorer.score(store, dimensions)
 
     def last_consecutive(self, l, n):
         if len(l) < n:
@@ -286,13 +300,41 @@ class Placer(object):
                 return False
         return True
 
-    def simulated_annealing_placement(self, initial_placements, dimensions, T_0=500, iterations=2000, generations=20):
+    def accept(self, cost_new, cost_old, T):
         """
-        Given an inital placement and initial temperature T_0, perform simulated
-        annealing to find the placement with the lowest cost.
+        Randomly accept this new change, or not, preferring decreases in
+        cost.
+        """
+        delta_cost = cost_new - cost_old
+        ratio = -delta_cost / T
+        if ratio > 1:
+            return True
+        acceptance_criterion = min(1, exp(ratio))
+        return random.random() < acceptance_criterion
+
+    def anneal(self, store, dimensions, T, T_0, iterations, generations, cooling=0.9, batch_size=1, verbose=True):
+        """
+        Perform simulated annealing on the PlacementStore store, in place,
+        starting at temperature T. Each of the (at most) iterations
+        temperature steps tries generations moves, and then multiplies T by
+        cooling (a cooling of 1 holds the temperature fixed).
+
+        If batch_size is more than 1, moves are proposed batch_size at a
+        time, touching disjoint cells and nets, and their costs are all
+        evaluated at once before each is accepted or rejected. Each cost
+        is taken against the placement from before the batch, so a batch
+        is an approximation of as many moves made one after the other.
+
+        Returns a dictionary of statistics about the run:
+        { "score": score of the final placement,
+          "T": final temperature,
+          "iterations": temperature steps performed,
+          "proposed": moves tried,
+          "accepted": moves accepted
+        }
         """
 
-        def update(T, alpha=lambda x: 0.9):
+        def update(T, alpha=lambda x: cooling):
             """
             Give the new temperature based on T and alpha.
 
@@ -301,68 +343,357 @@ class Placer(object):
             """
             return T * alpha(T)
 
-        def accept(cost_new, cost_old, T):
-            """
-            Randomly accept this new change, or not, preferring decreases in
-            cost.
-            """
-            delta_cost = cost_new - cost_old
-            ratio = -delta_cost / T
-            if ratio > 1:
-                return True
-            acceptance_criterion = min(1, exp(ratio))
-            return random.random() < acceptance_criterion
+        accept = self.accept
 
-        T = T_0
-        best_placements = initial_placements
+        # The cost engine re-scores only what each move touches
+        cost = IncrementalCost(self, store, dimensions)
 
         prev_scores = []
         iteration = 0
+        proposed = 0
+        accepted = 0
 
         try:
             prev_width = 0
             while iteration < iterations:
                 method = "displace"
-                for generation in xrange(generations):
-                    # print("  Generation", generation)
-                    new_placements, method_used = self.generate(best_placements, T, T_0, dimensions, method)
-
-                    new_score = self.score(new_placements, dimensions)
-                    old_score = self.score(best_placements, dimensions)
 
-                    # Accept or reject this new placement
-                    # If we rejected a "displace", do a reorientation next
-                    if accept(new_score, old_score, T):
-                        best_placements = new_placements
-                        taken_score = new_score
-                        if method_used == "reorient":
-                            method = "displace"
-                    else:
-                        taken_score = old_score
-                        if method_used == "displace":
-                            method = "reorient"
+                if batch_size > 1:
+                    # Evaluate batch_size moves at a time against the same
+                    # placement
+                    generation = 0
+                    while generation < generations:
+                        moves = self.propose_moves(store, min(batch_size, generations - generation), T, T_0, dimensions, method)
+                        deltas = cost.evaluate_moves([changes for changes, _ in moves])
+                        generation += len(moves)
+                        proposed += len(moves)
+
+                        for (changes, method_used), delta in zip(moves, deltas.tolist()):
+                            if accept(delta, 0, T):
+                                cost.move(changes)
+                                accepted += 1
+                                if method_used == "reorient":
+                                    method = "displace"
+                            elif method_used == "displace":
+                                method = "reorient"
+
+                        taken_score = cost.score
+                else:
+                    for generation in xrange(generations):
+                        # print("  Generation", generation)
+                        changes, method_used = self.propose_move(store, T, T_0, dimensions, method)
+
+                        old_score = cost.score
+                        new_score = cost.move(changes)
+                        proposed += 1
+
+                        # Accept or reject this new placement
+                        # If we rejected a "displace", do a reorientation next
+                        if accept(new_score, old_score, T):
+                            taken_score = new_score
+                            accepted += 1
+                            if method_used == "reorient":
+                                method = "displace"
+                        else:
+                            cost.undo()
+                            taken_score = old_score
+                            if method_used == "displace":
+                                method = "reorient"
 
                 T = update(T)
                 prev_scores.append(taken_score)
 
                 # Print iteration and score
-                sys.stdout.write("\b" * prev_width)
-                msg = "Iteration: {}  Score: {}".format(iteration, taken_score)
-                sys.stdout.write(msg)
-                sys.stdout.flush()
-                prev_width = len(msg)
+                if verbose:
+                    sys.stdout.write("\b" * prev_width)
+                    msg = "Iteration: {}  Score: {}".format(iteration, taken_score)
+                    sys.stdout.write(msg)
+                    sys.stdout.flush()
+                    prev_width = len(msg)
+
+                iteration += 1
 
                 if self.last_consecutive(prev_scores, 200):
                     break
 
+        except KeyboardInterrupt:
+            pass
+
+        store.commit()
+
+        return {"score": cost.score,
+                "T": T,
+                "iterations": iteration,
+                "proposed": proposed,
+                "accepted": accepted}
+
+    def adaptive_anneal(self, store, dimensions, T_0=None, iterations=2000, inner_num=2., target_acceptance=0.44, exit_ratio=1e-3, patience=3, verbose=True):
+        """
+        Perform simulated annealing on the PlacementStore store, in place,
+        with a schedule that adapts to how many moves are being accepted
+        (as in VPR):
+        - Each temperature tries inner_num * (number of cells)^(4/3) moves.
+        - The temperature drops quickly while nearly every move is accepted
+          or nearly none are, and slowly in between.
+        - The window that cells are displaced within, and interchanged
+          with the cells within, grows or shrinks to keep the fraction of
+          accepted moves near target_acceptance.
+        - Annealing stops once the standard deviation of the cost at a
+          temperature stays below exit_ratio of its mean for patience
+          temperatures in a row, or after iterations temperatures.
+
+        If T_0 is None, it is estimated as the standard deviation of the
+        cost of a sample of random moves (of all three kinds) from the
+        initial placement.
+
+        Returns statistics as in anneal().
+        """
+        cost = IncrementalCost(self, store, dimensions)
+        num_cells = len(store)
+
+        moves_per_temperature = max(1, int(inner_num * num_cells ** (4. / 3)))
+        window = 1.
+
+        if T_0 is None:
+            sampled_costs = []
+            for _ in xrange(num_cells):
+                method = random.choice(["displace", "reorient"])
+                changes, _ = self.propose_move(store, 1, 1, dimensions, method, window=window)
+                sampled_costs.append(cost.move(changes))
+                cost.undo()
+            T_0 = max(1., np.std(sampled_costs))
+            if verbose:
+                print("Starting temperature:", T_0)
+
+        T = T_0
+        iteration = 0
+        proposed = 0
+        accepted = 0
+        quiet_temperatures = 0
+
+        try:
+            prev_width = 0
+            while iteration < iterations:
+                method = "displace"
+                costs = []
+                accepted_here = 0
+
+                for generation in xrange(moves_per_temperature):
+                    changes, method_used = self.propose_move(store, T, T_0, dimensions, method, window=window)
+
+                    old_score = cost.score
+                    new_score = cost.move(changes)
+
+                    # If we rejected a "displace", do a reorientation next
+                    if self.accept(new_score, old_score, T):
+                        accepted_here += 1
+                        if method_used == "reorient":
+                            method = "displace"
+                    else:
+                        cost.undo()
+                        if method_used == "displace":
+                            method = "reorient"
+
+                    costs.append(cost.score)
+
+                proposed += moves_per_temperature
+                accepted += accepted_here
+                acceptance = float(accepted_here) / moves_per_temperature
+
+                # Cool quickly where little changes
+                if acceptance > 0.96:
+                    alpha = 0.5
+                elif acceptance > 0.8:
+                    alpha = 0.9
+                elif acceptance > 0.15:
+                    alpha = 0.95
+                else:
+                    alpha = 0.8
+                T *= alpha
+
+                # Range limiter
+                window = min(1., max(0., window * (1 - target_acceptance + acceptance)))
+
+                if verbose:
+                    sys.stdout.write("\b" * prev_width)
+                    msg = "Iteration: {}  Score: {}  T: {:.3f}  Accepted: {:.2f}  Window: {:.3f}".format(iteration, cost.score, T, acceptance, window)
+                    sys.stdout.write(msg)
+                    sys.stdout.flush()
+                    prev_width = len(msg)
+
                 iteration += 1
 
+                if np.std(costs) <= exit_ratio * max(1, np.mean(costs)):
+                    quiet_temperatures += 1
+                    if quiet_temperatures >= patience:
+                        break
+                else:
+                    quiet_temperatures = 0
+
         except KeyboardInterrupt:
             pass
 
+        store.commit()
+
+        return {"score": cost.score,
+                "T": T,
+                "iterations": iteration,
+                "proposed": proposed,
+                "accepted": accepted}
+
+    def simulated_annealing_placement(self, initial_placements, dimensions, T_0=500, iterations=2000, generations=20, schedule="fixed", batch_size=1):
+        """
+        Given an inital placement and initial temperature T_0, perform simulated
+        annealing to find the placement with the lowest cost.
+
+        schedule can be "fixed", which multiplies the temperature by 0.9
+        after every generations moves, or "adaptive" (see adaptive_anneal(),
+        where T_0 may be None).
+
+        batch_size is as for anneal(), with the fixed schedule.
+        """
+        store = PlacementStore.from_placements(initial_placements, self.cell_names)
+
+        if schedule == "fixed":
+            self.anneal(store, dimensions, T_0, T_0, iterations, generations, batch_size=batch_size)
+        elif schedule == "adaptive":
+            self.adaptive_anneal(store, dimensions, T_0, iterations)
+        else:
+            raise ValueError("Schedule must be 'fixed' or 'adaptive'")
+
         print("\nPlacement complete")
 
-        return best_placements
+        return store.to_placements()
+
+    def parallel_annealing_placement(self, initial_placements, dimensions, T_0=500, iterations=2000, generations=20, workers=4, chains=None, seed=0, mode="tempering", exchange_interval=10, T_min=1):
+        """
+        Perform simulated annealing with several chains at once, each run
+        in one of workers processes.
+
+        In "tempering" mode (replica exchange), chain k is held at a fixed
+        temperature on a geometric ladder from T_0 down to T_min. Every
+        exchange_interval temperature steps, the chains stop and neighboring
+        temperatures swap placements with the usual replica exchange
+        probability. There are iterations steps in total.
+
+        In "multistart" mode, every chain performs the whole annealing
+        schedule of simulated_annealing_placement() on its own.
+
+        Every chain starts from initial_placements, and the random numbers
+        of each chain are derived from seed, so the same seed, chains and
+        mode give the same result no matter the number of workers.
+
+        Returns the best placement seen, and a list with the statistics of
+        each chain:
+        [ { "T": temperature of the chain (at the end, for multistart),
+            "score": score of the chain's final placement,
+            "best_score": best score the chain reached,
+            "proposed": moves tried,
+            "accepted": moves accepted,
+            "exchanges_proposed": replica exchanges tried,
+            "exchanges_accepted": replica exchanges accepted
+          },
+          ...
+        ]
+        """
+        if chains is None:
+            chains = workers
+
+        if mode not in ["tempering", "multistart"]:
+            raise ValueError("Mode must be 'tempering' or 'multistart'")
+
+        master_random = random.Random(seed)
+
+        base_store = PlacementStore.from_placements(initial_placements, self.cell_names)
+        states = [(base_store.anchors, base_store.turns)] * chains
+
+        if mode == "tempering" and chains > 1:
+            temperatures = [T_0 * (float(T_min) / T_0) ** (float(k) / (chains - 1)) for k in xrange(chains)]
+            rounds = int(ceil(float(iterations) / exchange_interval))
+            steps, cooling = exchange_interval, 1
+        else:
+            temperatures = [T_0] * chains
+            rounds = 1
+            steps, cooling = iterations, 0.9
+
+        stats = [{"T": T,
+                  "score": None,
+                  "best_score": None,
+                  "proposed": 0,
+                  "accepted": 0,
+                  "exchanges_proposed": 0,
+                  "exchanges_accepted": 0} for T in temperatures]
+
+        best_score = None
+        best_state = states[0]
+
+        pool = None
+        if workers > 1:
+            pool = Pool(workers, init_annealing_worker, (self, base_store))
+        else:
+            init_annealing_worker(self, base_store)
+
+        try:
+            for r in xrange(rounds):
+                jobs = []
+                for k, (anchors, turns) in enumerate(states):
+                    chain_seed = master_random.randrange(2**32)
+                    jobs.append((anchors, turns, dimensions, temperatures[k], T_0, steps, generations, cooling, chain_seed))
+
+                if pool is not None:
+                    results = pool.map(annealing_worker, jobs)
+                else:
+                    results = map(annealing_worker, jobs)
+
+                states = []
+                scores = []
+                for k, (anchors, turns, result) in enumerate(results):
+                    states.append((anchors, turns))
+                    scores.append(result["score"])
+
+                    chain_stats = stats[k]
+                    chain_stats["T"] = result["T"]
+                    chain_stats["score"] = result["score"]
+                    chain_stats["proposed"] += result["proposed"]
+                    chain_stats["accepted"] += result["accepted"]
+
+                    if chain_stats["best_score"] is None or result["score"] < chain_stats["best_score"]:
+                        chain_stats["best_score"] = result["score"]
+
+                    if best_score is None or result["score"] < best_score:
+                        best_score = result["score"]
+                        best_state = (anchors, turns)
+
+                # Replica exchange between neighboring temperatures,
+                # alternating between even and odd pairs
+                if cooling == 1:
+                    for k in xrange(r % 2, chains - 1, 2):
+                        stats[k]["exchanges_proposed"] += 1
+                        stats[k+1]["exchanges_proposed"] += 1
+
+                        ratio = (1. / temperatures[k] - 1. / temperatures[k+1]) * (scores[k] - scores[k+1])
+                        if ratio >= 0 or master_random.random() < exp(ratio):
+                            states[k], states[k+1] = states[k+1], states[k]
+                            scores[k], scores[k+1] = scores[k+1], scores[k]
+                            stats[k]["exchanges_accepted"] += 1
+                            stats[k+1]["exchanges_accepted"] += 1
+
+                print("Round: {}  Best score: {}  Chain scores: {}".format(r, best_score, scores))
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        print("Placement complete")
+
+        store = base_store.copy()
+        store.anchors, store.turns = best_state
+
+        return store.to_placements(), stats
 
     def placement_to_layout(self, dimensions, placements, min_y=5):
         """
@@ -394,39 +725,14 @@ class Placer(object):
         Returns a copy of the placements with the smallest bounding box,
         and the dimensions of such.
         """
-        ys = []
-        zs = []
-        xs = []
-
-        placements = deepcopy(placements)
+        store = PlacementStore.from_placements(placements, self.cell_names)
 
-        for placement in placements:
-            rotation = placement["turns"]
-            cell_name = placement["name"]
-            cell = self.pregenerated_cells[cell_name][rotation]
+        lo, hi = store.extents(self.cell_shapes)
+        store.anchors -= lo
 
-            y, z, x = placement["placement"]
-            h, w, l = cell.blocks.shape
+        return store.to_placements(), (hi - lo + 1).tolist()
 
-            ys += [y, y+h]
-            zs += [z, z+w]
-            xs += [x, x+l]
-
-        min_y, max_y = min(ys), max(ys)
-        min_z, max_z = min(zs), max(zs)
-        min_x, max_x = min(xs), max(xs)
-
-        dy = max_y - min_y + 1
-        dz = max_z - min_z + 1
-        dx = max_x - min_x + 1
-
-        for placement in placements:
-            y, z, x = placement["placement"]
-            placement["placement"] = [y - min_y, z - min_z, x - min_x]
-
-        return placements, [dy, dz, dx]
-
-    def place_pins(self, dimensions):
+    def place_pins(self, dimensions, verbose=True):
         """
         Place pins around the west and east rims of the circuit.
         """
@@ -460,14 +766,16 @@ class Placer(object):
         for i, input_net_name in enumerate(input_nets):
             coord = [y, z + (pin_spacing * i), x]
             pin_placements.append(create_input_pin(input_net_name, coord))
-            print("Placed input pin %s"%input_net_name)
+            if verbose:
+                print("Placed input pin %s"%input_net_name)
 
         # place output pins
         x = dimensions[2] + margin
         for i, output_net_name in enumerate(output_nets):
             coord = [y, z + (pin_spacing * i), x]
             pin_placements.append(create_output_pin(output_net_name, coord))
-            print("Placed output pin %s"%output_net_name)
+            if verbose:
+                print("Placed output pin %s"%output_net_name)
 
         # print("Placed", len(pin_placements), "pins")
 
@@ -494,60 +802,353 @@ class GridPlacer(Placer):
         nx = int(round(x / self.interval) * self.interval)
         return (y, nz, nx)
 
-    def generate(self, old_placements, T, T_0, dimensions, method="displace", displace_interchange_ratio=5):
+    def analytical_placement(self, dimensions=None, star_threshold=8):
+        """
+        Generate an initial placement by minimizing the squared wire length
+        between cells, and then spreading the cells onto the grid.
+
+        Every net is modelled as a clique of springs between its pins, with
+        the input and output pins held fixed on the west and east rims (as
+        place_pins() would place them). Nets with more than star_threshold
+        pins (like clocks) are instead connected through an extra, movable
+        star point. Solving the resulting sparse linear systems gives the
+        Z and X of every cell; the cells are then spread out by rank into
+        square rows and columns of grid locations.
+
+        dimensions and the returned placements are as in initial_placement().
         """
-        Given an old placement, generate a new placement by either switching
-        the location of two cells or displacing a cell or rotating it.
+        dimensions = self.check_dimensions(dimensions)
 
-        T is the current temperature; T_0 is the starting temperature. This
-        is used to scale the window for displacing a cell.
+        blif_cells = self.blif.cells
+        num_cells = len(blif_cells)
+        num_cells_side = int(ceil(sqrt(num_cells)))
+        region_width = num_cells_side * self.interval
+
+        # Locations of the fixed pins, keyed by net
+        anchors = defaultdict(list)
+        for pin in self.place_pins([dimensions[0], region_width, region_width], verbose=False):
+            y, z, x = pin["placement"]
+            for net in pin["pins"].itervalues():
+                anchors[net].append((z, x))
+
+        # Cells (and star points) on each net
+        net_cells = defaultdict(list)
+        for i, blif_cell in enumerate(blif_cells):
+            for net in blif_cell["pins"].itervalues():
+                net_cells[net].append(i)
+
+        num_variables = num_cells
+        rows, cols, weights = [], [], []
+        rhs = np.zeros((num_cells + len(net_cells), 2))
+
+        def connect(u, v, w):
+            rows.extend([u, v, u, v])
+            cols.extend([u, v, v, u])
+            weights.extend([w, w, -w, -w])
+
+        def anchor(u, coord, w):
+            rows.append(u)
+            cols.append(u)
+            weights.append(w)
+            rhs[u] += np.multiply(w, coord)
+
+        for net, members in net_cells.iteritems():
+            fixed = anchors[net]
+            degree = len(members) + len(fixed)
+            if degree < 2:
+                continue
 
-        method can be "displace" or "reorient".
+            clique_weight = 1. / (degree - 1)
+
+            if degree > star_threshold:
+                # Star model, equivalent to a clique for the best star point
+                star = num_variables
+                num_variables += 1
+                star_weight = degree * clique_weight
+                for u in members:
+                    connect(u, star, star_weight)
+                for coord in fixed:
+                    anchor(star, coord, star_weight)
+            else:
+                for a in xrange(len(members)):
+                    for b in xrange(a + 1, len(members)):
+                        if members[a] != members[b]:
+                            connect(members[a], members[b], clique_weight)
+                    for coord in fixed:
+                        anchor(members[a], coord, clique_weight)
+
+        # Gently pull everything toward the middle, so that cells not
+        # connected to any pin still have a well-defined location
+        center = (region_width / 2., region_width / 2.)
+        for u in xrange(num_variables):
+            anchor(u, center, 1e-3)
+
+        laplacian = sp.coo_matrix((weights, (rows, cols)), shape=(num_variables, num_variables)).tocsc()
+        rhs = rhs[:num_variables]
+        zs = spsolve(laplacian, rhs[:, 0])[:num_cells]
+        xs = spsolve(laplacian, rhs[:, 1])[:num_cells]
+
+        # Spread by rank: columns by X, and then rows by Z within a column
+        slots = {}
+        by_x = sorted(xrange(num_cells), key=lambda i: (xs[i], zs[i]))
+        for col in xrange(num_cells_side):
+            column = by_x[col * num_cells_side:(col + 1) * num_cells_side]
+            for row, i in enumerate(sorted(column, key=lambda i: (zs[i], xs[i]))):
+                slots[i] = (row, col)
 
-        displace_interchange_ratio is the ratio of how often you displace
-        a cell and how often you interchange it with another cell.
+        placements = []
+        for i, blif_cell in enumerate(blif_cells):
+            row, col = slots[i]
+            coord = self.snap_to_grid((0, row * self.interval, col * self.interval))
+
+            placement = {"name": blif_cell["name"],
+                         "placement": list(coord),
+                         "turns": 0,
+                         "pins": blif_cell["pins"]}
+
+            placements.append(placement)
+
+        return placements, dimensions
+
+    def window_extent(self, dimensions, scaling_factor):
+        """
+        Returns how far in Z and X a cell may move within a window of the
+        given scaling_factor: up to 10 grid intervals.
         """
-        new_placements = deepcopy(old_placements)
+        window_half_dim = int(max(1, round(10 * scaling_factor)))
+        return (window_half_dim * self.interval, window_half_dim * self.interval)
 
-        # Select a random cell to interchange, displace, or orient
-        cellA = random.choice(new_placements)
+    def displace(self, coord, T, T_0, dimensions, scaling_factor=None):
+        """
+        Move a cell by a whole number of grid intervals, from a window that
+        shrinks as the temperature T drops from T_0 (or as given by
+        scaling_factor, as in Placer.displace()).
+        """
+        if scaling_factor is None:
+            scaling_factor = log(T) / log(T_0)
 
-        method_used = ""
+        window_half_dim = self.window_extent(dimensions, scaling_factor)[0] // self.interval
 
-        interchange = random.random() > (1. / displace_interchange_ratio)
-        if interchange:
-            cellB = cellA
-            while cellB is cellA:
-                cellB = random.choice(new_placements)
+        old_y, z, x = coord
 
-            # print("Interchanging {} (at {}) with {} (at {})".format(cellA["name"], cellA["placement"], cellB["name"], cellB["placement"]))
-            cellA["placement"], cellB["placement"] = cellB["placement"], cellA["placement"]
-            method_used = "interchange"
-        else: # displace or reorient
-            if method == "displace":
-                scaling_factor = log(T) / log(T_0)
+        # Select new X and Z from window
+        dx = random.randint(-window_half_dim, window_half_dim) * self.interval
+        dz = random.randint(-window_half_dim, window_half_dim) * self.interval
 
-                window_half_dim = max(1, round(10 * scaling_factor))
+        new_coord = [old_y, z + dz, x + dx]
 
-                old_y, window_center_z, window_center_x = cellA["placement"]
+        return self.snap_to_grid(new_coord)
 
-                # Select new X and Z from window
-                dx = random.randint(-window_half_dim, window_half_dim) * self.interval
-                dz = random.randint(-window_half_dim, window_half_dim) * self.interval
+class PartitionPlacer(GridPlacer):
+    """
+    PartitionPlacer places large designs by recursive min-cut bisection.
+    The netlist is split in two with as few nets cut as possible, each
+    half is given its share of the grid, and so on until each region holds
+    at most leaf_size cells. Each leaf region is then placed on its own by
+    simulated annealing, in parallel across workers processes.
+
+    Nets that leave a region still count while it is annealed (terminal
+    propagation): the cells on them in other regions are held fixed at
+    the centres of their regions.
+    """
 
-                y, z, x = cellA["placement"]
+    def __init__(self, blif, pregenerated_cells, grid_spacing=1, leaf_size=64, workers=1):
+        super(PartitionPlacer, self).__init__(blif, pregenerated_cells, grid_spacing)
+        self.leaf_size = leaf_size
+        self.workers = workers
 
-                new_coord = [old_y, z + dz, x + dx]
-                
-                cellA["placement"] = self.snap_to_grid(new_coord)
-                method_used = "displace"
+    def partition(self, cell_indices, region, rng):
+        """
+        Recursively bisect the cells (indices into blif.cells) and the
+        region of grid locations (row, col, rows, cols) they are given.
 
-            elif method == "reorient":
-                # Rotate 90 degrees
-                cellA["turns"] = (cellA["turns"] + 1) % 4
-                method_used = "reorient"
+        Returns a list of (cell indices, region) leaves.
+        """
+        row, col, rows, cols = region
 
-            else:
-                raise ValueError("Method must be 'displace' or 'reorient'")
+        if len(cell_indices) <= self.leaf_size:
+            return [(cell_indices, region)]
+
+        cells = [self.blif.cells[i] for i in cell_indices]
+        left, right = bisect(cells, rng=rng)
+        left = [cell_indices[i] for i in left]
+        right = [cell_indices[i] for i in right]
+
+        # Cut the longer side of the region in proportion to the halves,
+        # leaving each enough locations for its cells
+        if cols >= rows:
+            length, other = cols, rows
+        else:
+            length, other = rows, cols
+
+        cut = int(round(length * float(len(left)) / len(cell_indices)))
+        cut = max(cut, int(ceil(float(len(left)) / other)))
+        cut = min(cut, length - int(ceil(float(len(right)) / other)))
+
+        if cols >= rows:
+            left_region = (row, col, rows, cut)
+            right_region = (row, col + cut, rows, cols - cut)
+        else:
+            left_region = (row, col, cut, cols)
+            right_region = (row + cut, col, rows - cut, cols)
+
+        return self.partition(left, left_region, rng) + self.partition(right, right_region, rng)
+
+    def place_leaf(self, leaf_cells, rows, cols, T_0, iterations, generations, terminals=()):
+        """
+        Anneal leaf_cells (as in BLIF.cells) within a region of rows by
+        cols grid locations, starting from the cells in order, row by row.
+
+        terminals are (cell, (z, x)) of cells outside the region, with only
+        the pins on nets of leaf_cells, fixed at (z, x) relative to the
+        region while it is annealed.
+        """
+        terminal_cells = [cell for cell, _ in terminals]
+        leaf_blif = BLIF(self.blif.model, [], [], self.blif.clocks, leaf_cells + terminal_cells, [])
+        leaf_placer = GridPlacer(leaf_blif, self.pregenerated_cells, self.grid_spacing)
+        leaf_placer.num_movable = len(leaf_cells)
+
+        height = max(self.pregenerated_cells[cell["name"]][0].blocks.shape[0] for cell in leaf_cells)
+        dimensions = (height, rows * self.interval, cols * self.interval)
+
+        placements = []
+        for k, cell in enumerate(leaf_cells):
+            coord = [0, (k // cols) * self.interval, (k % cols) * self.interval]
+            placements.append({"name": cell["name"],
+                               "placement": coord,
+                               "turns": 0,
+                               "pins": cell["pins"]})
+
+        for cell, (z, x) in terminals:
+            placements.append({"name": cell["name"],
+                               "placement": [0, z, x],
+                               "turns": 0,
+                               "pins": cell["pins"]})
+
+        store = PlacementStore.from_placements(placements, leaf_placer.cell_names)
+        leaf_placer.anneal(store, dimensions, T_0, T_0, iterations, generations, verbose=False)
+
+        return store.to_placements()[:len(leaf_cells)]
+
+    def leaf_terminals(self, leaves):
+        """
+        Returns the terminals (as for place_leaf()) of each of leaves, a
+        list of (cell indices, region): for every net of the leaf, one cell
+        on it from each other region it reaches, with only its pin on that
+        net, at the centre of that region.
+        """
+        cells = self.blif.cells
+
+        # The leaf of each cell
+        cell_leaves = [None] * len(cells)
+        for k, (cell_indices, _) in enumerate(leaves):
+            for i in cell_indices:
+                cell_leaves[i] = k
+
+        # A pin on each net in each leaf
+        net_leaf_pins = defaultdict(dict)
+        for i, cell in enumerate(cells):
+            for pin, net in sorted(cell["pins"].iteritems()):
+                net_leaf_pins[net].setdefault(cell_leaves[i], (i, pin))
+
+        all_terminals = []
+        for k, (cell_indices, (row, col, _, _)) in enumerate(leaves):
+            nets = sorted(set(net for i in cell_indices for net in cells[i]["pins"].itervalues()))
+
+            terminals = []
+            for net in nets:
+                for other, (i, pin) in sorted(net_leaf_pins[net].iteritems()):
+                    if other == k:
+                        continue
+
+                    _, (other_row, other_col, other_rows, other_cols) = leaves[other]
+                    z = (other_row + other_rows // 2 - row) * self.interval
+                    x = (other_col + other_cols // 2 - col) * self.interval
+                    terminals.append(({"name": cells[i]["name"], "pins": {pin: net}}, (z, x)))
+
+            all_terminals.append(terminals)
+
+        return all_terminals
+
+    def partition_placement(self, T_0=250, iterations=2000, generations=20, seed=0, whitespace=0.2):
+        """
+        Place the cells by recursive bisection, leaving whitespace (as a
+        fraction of the number of cells) of the grid locations empty.
+
+        Returns placements and dimensions as in initial_placement().
+        """
+        rng = random.Random(seed)
+
+        num_cells = len(self.blif.cells)
+        side = int(ceil(sqrt(num_cells * (1 + whitespace))))
+
+        leaves = self.partition(range(num_cells), (0, 0, side, side), rng)
+        print("Partitioned {} cells into {} regions".format(num_cells, len(leaves)))
+
+        jobs = []
+        for (cell_indices, (row, col, rows, cols)), terminals in zip(leaves, self.leaf_terminals(leaves)):
+            leaf_cells = [self.blif.cells[i] for i in cell_indices]
+            jobs.append((leaf_cells, rows, cols, T_0, iterations, generations, terminals, rng.randrange(2**32)))
+
+        if self.workers > 1:
+            pool = Pool(self.workers, init_annealing_worker, (self, None))
+            try:
+                results = pool.map(partition_leaf_worker, jobs)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            init_annealing_worker(self, None)
+            results = map(partition_leaf_worker, jobs)
+
+        # Move each leaf into its region, and back into netlist order
+        placements = [None] * num_cells
+        for (cell_indices, (row, col, rows, cols)), leaf_placements in zip(leaves, results):
+            for i, placement in zip(cell_indices, leaf_placements):
+                y, z, x = placement["placement"]
+                placement["placement"] = [y, z + row * self.interval, x + col * self.interval]
+                placements[i] = placement
+
+        height = max(self.pregenerated_cells[cell["name"]][0].blocks.shape[0] for cell in self.blif.cells)
+        dimensions = (height, side * self.interval, side * self.interval)
+
+        return placements, dimensions
+
+
+# Placer and placement shared with the processes of
+# parallel_annealing_placement() and partition_placement()
+worker_placer = None
+worker_store = None
+
+def init_annealing_worker(placer, store):
+    global worker_placer, worker_store
+    worker_placer = placer
+    worker_store = store
+
+def annealing_worker(job):
+    """
+    Anneal one chain of parallel_annealing_placement(), returning its new
+    anchors and turns along with the statistics from Placer.anneal().
+    """
+    anchors, turns, dimensions, T, T_0, iterations, generations, cooling, seed = job
+
+    random.seed(seed)
+
+    store = worker_store.copy()
+    store.anchors = anchors.copy()
+    store.turns = turns.copy()
+
+    result = worker_placer.anneal(store, dimensions, T, T_0, iterations, generations, cooling, verbose=False)
+
+    return store.anchors, store.turns, result
+
+def partition_leaf_worker(job):
+    """
+    Place one leaf region of PartitionPlacer.partition_placement(),
+    returning the placements of its cells relative to the region.
+    """
+    leaf_cells, rows, cols, T_0, iterations, generations, terminals, seed = job
+
+    random.seed(seed)
 
-        return new_placements, method_used
+    return worker_placer.place_leaf(leaf_cells, rows, cols, T_0, iterations, generations, terminals)
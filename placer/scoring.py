@@ -0,0 +1,106 @@
+from __future__ import print_function
+
+import numpy as np
+
+class BatchScorer(object):
+    """
+    BatchScorer computes the score of a whole placement (as Placer.score
+    does) with a handful of NumPy operations, rather than a Python loop
+    over every cell, pin and net.
+
+    The pins of the netlist are kept sorted by net, so that the bounding
+    box of every net is a segment reduction (np.minimum.reduceat and
+    np.maximum.reduceat) over one array of pin coordinates. The occupancy
+    of the layout is counted by gathering the flat index of every location
+    of every cell's footprint, and counting them with np.bincount.
+
+    PlacementStores given to score() must have their cells in the same
+    order as the placer's NetIndex.
+    """
+    def __init__(self, placer):
+        netlist = placer.netlist
+        blif_cells = placer.blif.cells
+
+        self.cell_shapes = placer.cell_shapes
+        self.cell_footprints = placer.cell_footprints
+
+        # Pin indices sorted by net, and where each net starts among them
+        pin_nets = np.array(netlist.pin_nets, dtype=np.int)
+        self.pin_order = np.argsort(pin_nets, kind="mergesort")
+        self.pin_cells = np.array(netlist.pin_cells, dtype=np.int)[self.pin_order]
+        self.net_counts = np.bincount(pin_nets, minlength=len(netlist))
+        self.net_starts = np.cumsum(self.net_counts) - self.net_counts
+
+        # (y, z, x) of each pin relative to its cell's anchor, for each
+        # rotation of the cell
+        self.pin_offsets = np.zeros((len(self.pin_order), 4, 3), dtype=np.int)
+        for p, (i, pin_name) in enumerate(zip(netlist.pin_cells, netlist.pin_names)):
+            rotations = placer.pregenerated_cells[blif_cells[i]["name"]]
+            for turns, cell in enumerate(rotations):
+                self.pin_offsets[p, turns] = cell.ports[pin_name]["coordinates"]
+
+        # (y, z, x) of each occupied location of each footprint
+        self.footprint_coords = [[np.array(np.nonzero(footprint)).T for footprint in rotations] for rotations in self.cell_footprints]
+
+    def locate_pins(self, store):
+        """
+        Returns the (y, z, x) of every pin, as one row per pin, sorted by
+        net.
+        """
+        cells = self.pin_cells
+        return store.anchors[cells] + self.pin_offsets[self.pin_order, store.turns[cells]]
+
+    def compute_net_lengths(self, store):
+        """
+        Returns the half-perimeter length of the bounding box of every net.
+        """
+        coords = self.locate_pins(store)
+        lo = np.minimum.reduceat(coords, self.net_starts, axis=0)
+        hi = np.maximum.reduceat(coords, self.net_starts, axis=0)
+        return (hi - lo).sum(axis=1)
+
+    def compute_occupancy(self, store):
+        """
+        Returns the number of cells occupying each location between the
+        extents of the store, and the (y, z, x) of its first location.
+        """
+        lo, hi = store.extents(self.cell_shapes)
+        shape = hi - lo
+        strides = np.array([shape[1] * shape[2], shape[2], 1])
+
+        # Flat index of the anchor of every cell
+        anchors = (store.anchors - lo).dot(strides)
+
+        # Gather each (cell type, rotation) at once
+        locations = []
+        kinds = store.cell_types * 4 + store.turns
+        for kind in np.unique(kinds):
+            cells = kinds == kind
+            offsets = self.footprint_coords[kind // 4][kind % 4].dot(strides)
+            locations.append((anchors[cells][:, None] + offsets[None, :]).ravel())
+
+        occupancy = np.bincount(np.concatenate(locations), minlength=shape.prod())
+
+        return occupancy.reshape(shape), lo
+
+    def score(self, store, dimensions):
+        """
+        Returns the score of the placement held in store, laid out in
+        dimensions.
+        """
+        if len(store) == 0:
+            return 0
+
+        wire_length_penalty = self.compute_net_lengths(store).sum() if len(self.net_starts) else 0
+
+        occupancy, (y, z, x) = self.compute_occupancy(store)
+        occupied = occupancy.sum()
+
+        # Every cell in excess of one at a location
+        overlap_penalty = occupied - np.count_nonzero(occupancy)
+
+        (h, w, l) = dimensions
+        inside = occupancy[max(-y, 0):max(h - y, 0), max(-z, 0):max(w - z, 0), max(-x, 0):max(l - x, 0)]
+        oob_penalty = occupied - inside.sum()
+
+        return int(wire_length_penalty + overlap_penalty + oob_penalty)
@@ -0,0 +1,107 @@
+from __future__ import print_function
+
+import numpy as np
+
+class PlacementStore(object):
+    """
+    PlacementStore holds a placement as NumPy arrays rather than the list
+    of dictionaries used by placements.json:
+    - cell_types: index of each cell's name in cell_names
+    - anchors: (y, z, x) of each cell, one row per cell
+    - turns: rotation of each cell
+
+    The "pins" dictionary of each cell is kept in a table shared between
+    copies of the store, and must not be modified.
+
+    move() records the previous state of a cell, so that a move can be
+    reverted with undo() or made permanent with commit().
+    """
+    def __init__(self, cell_names, cell_types, anchors, turns, pins):
+        self.cell_names = cell_names
+        self.cell_types = cell_types
+        self.anchors = anchors
+        self.turns = turns
+        self.pins = pins
+
+        self.undo_log = []
+
+    @classmethod
+    def from_placements(cls, placements, cell_names):
+        """
+        Build a store from a list of placement dictionaries, with cell
+        names indexed by cell_names.
+        """
+        name_index = dict((name, i) for i, name in enumerate(cell_names))
+
+        cell_types = np.array([name_index[p["name"]] for p in placements], dtype=np.int)
+        anchors = np.array([p["placement"] for p in placements], dtype=np.int).reshape((len(placements), 3))
+        turns = np.array([p["turns"] for p in placements], dtype=np.int)
+        pins = tuple(p["pins"] for p in placements)
+
+        return cls(cell_names, cell_types, anchors, turns, pins)
+
+    def to_placements(self):
+        """
+        Convert back into a list of placement dictionaries.
+        """
+        placements = []
+        for cell_type, anchor, turns, pins in zip(self.cell_types.tolist(), self.anchors.tolist(), self.turns.tolist(), self.pins):
+            placement = {"name": self.cell_names[cell_type],
+                         "placement": anchor,
+                         "turns": turns,
+                         "pins": pins}
+            placements.append(placement)
+
+        return placements
+
+    def __len__(self):
+        return len(self.cell_types)
+
+    def copy(self):
+        """
+        Returns a copy whose arrays can be modified independently of this
+        one. The pin table is shared.
+        """
+        return PlacementStore(self.cell_names, self.cell_types.copy(), self.anchors.copy(), self.turns.copy(), self.pins)
+
+    def name(self, i):
+        return self.cell_names[self.cell_types[i]]
+
+    def anchor(self, i):
+        return tuple(self.anchors[i].tolist())
+
+    def move(self, i, anchor, turns):
+        """
+        Move cell i to anchor with the given rotation.
+        """
+        self.undo_log.append((i, self.anchor(i), self.turns[i]))
+        self.anchors[i] = anchor
+        self.turns[i] = turns
+
+    def moved_cells(self):
+        """
+        Returns the cells changed since the last commit() or undo().
+        """
+        return [i for i, _, _ in self.undo_log]
+
+    def undo(self):
+        """
+        Revert every move() since the last commit() or undo().
+        """
+        for i, anchor, turns in reversed(self.undo_log):
+            self.anchors[i] = anchor
+            self.turns[i] = turns
+        self.undo_log = []
+
+    def commit(self):
+        self.undo_log = []
+
+    def extents(self, cell_shapes):
+        """
+        Returns the minimum and maximum (y, z, x) covered by the cells,
+        given the shapes of each cell type and rotation.
+        """
+        shapes = cell_shapes[self.cell_types, self.turns]
+        lo = self.anchors.min(axis=0)
+        hi = (self.anchors + shapes).max(axis=0)
+        return lo, hi
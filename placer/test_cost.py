@@ -0,0 +1,104 @@
+from __future__ import print_function
+
+import random
+
+import numpy as np
+import pytest
+
+from cost import IncrementalCost
+from placer import GridPlacer
+from store import PlacementStore
+
+def occupied_locations(grid):
+    """
+    Returns the (y, z, x) and count of every occupied location of an
+    OccupancyGrid, whatever its extent, in row-major order.
+    """
+    occupied = grid.grid != 0
+    return np.argwhere(occupied) + grid.origin, grid.grid[occupied]
+
+def random_state(pregenerated_cells, random_blif, random_placements, seed):
+    blif = random_blif(30, 12, seed)
+    placer = GridPlacer(blif, pregenerated_cells, grid_spacing=5)
+    _, dimensions = placer.initial_placement()
+    placements = random_placements(placer, blif, dimensions, seed)
+    store = PlacementStore.from_placements(placements, placer.cell_names)
+    return placer, store, dimensions
+
+@pytest.mark.parametrize("seed", range(3))
+def test_score_matches_reference(pregenerated_cells, random_blif, random_placements, reference_score, seed):
+    placer, store, dimensions = random_state(pregenerated_cells, random_blif, random_placements, seed)
+    placements = store.to_placements()
+
+    cost = IncrementalCost(placer, store, dimensions)
+
+    assert cost.score == reference_score(placements, dimensions)
+
+@pytest.mark.parametrize("seed", range(3))
+def test_moves_match_rescoring(pregenerated_cells, random_blif, random_placements, reference_score, seed):
+    placer, store, dimensions = random_state(pregenerated_cells, random_blif, random_placements, seed)
+    cost = IncrementalCost(placer, store, dimensions)
+    random.seed(seed)
+
+    for _ in xrange(200):
+        method = random.choice(["displace", "reorient"])
+        changes, _ = placer.propose_move(store, 100, 250, dimensions, method)
+
+        score = cost.move(changes)
+        assert score == cost.score
+        assert score == reference_score(store.to_placements(), dimensions)
+
+        if random.random() < 0.5:
+            cost.undo()
+            assert cost.score == reference_score(store.to_placements(), dimensions)
+
+@pytest.mark.parametrize("seed", range(3))
+def test_undo_restores_state(pregenerated_cells, random_blif, random_placements, seed):
+    placer, store, dimensions = random_state(pregenerated_cells, random_blif, random_placements, seed)
+    cost = IncrementalCost(placer, store, dimensions)
+    random.seed(seed)
+
+    for _ in xrange(25):
+        anchors = store.anchors.copy()
+        turns = store.turns.copy()
+        score = cost.score
+        net_lengths = list(cost.net_lengths)
+        pin_coords = list(cost.pin_coords)
+        occupied = occupied_locations(cost.grid)
+
+        method = random.choice(["displace", "reorient"])
+        changes, _ = placer.propose_move(store, 100, 250, dimensions, method)
+        cost.move(changes)
+        cost.undo()
+
+        assert (store.anchors == anchors).all()
+        assert (store.turns == turns).all()
+        assert cost.score == score
+        assert cost.net_lengths == net_lengths
+        assert cost.pin_coords == pin_coords
+        for before, after in zip(occupied, occupied_locations(cost.grid)):
+            assert np.array_equal(before, after)
+
+        # Keep the next move starting from somewhere new
+        cost.move(placer.propose_move(store, 100, 250, dimensions, "displace")[0])
+
+@pytest.mark.parametrize("seed", range(3))
+def test_evaluate_moves_matches_moving(pregenerated_cells, random_blif, random_placements, seed):
+    placer, store, dimensions = random_state(pregenerated_cells, random_blif, random_placements, seed)
+    cost = IncrementalCost(placer, store, dimensions)
+    random.seed(seed)
+
+    for _ in xrange(20):
+        method = random.choice(["displace", "reorient"])
+        candidates = [changes for changes, _ in placer.propose_moves(store, 8, 100, 250, dimensions, method)]
+        deltas = cost.evaluate_moves(candidates)
+
+        score = cost.score
+        for changes, delta in zip(candidates, deltas.tolist()):
+            assert cost.move(changes) - score == delta
+            cost.undo()
+
+        assert cost.score == score
+
+        # Take one of them, so the next batch starts from somewhere new
+        cost.move(candidates[0])
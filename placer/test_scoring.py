@@ -0,0 +1,51 @@
+from __future__ import print_function
+
+from collections import defaultdict
+
+import pytest
+
+from placer import GridPlacer
+from store import PlacementStore
+
+def random_state(pregenerated_cells, random_blif, random_placements, seed):
+    blif = random_blif(40, 15, seed)
+    placer = GridPlacer(blif, pregenerated_cells, grid_spacing=5)
+    _, dimensions = placer.initial_placement()
+    placements = random_placements(placer, blif, dimensions, seed)
+    return placer, placements, dimensions
+
+@pytest.mark.parametrize("seed", range(5))
+def test_score_matches_reference(pregenerated_cells, random_blif, random_placements, reference_score, seed):
+    placer, placements, dimensions = random_state(pregenerated_cells, random_blif, random_placements, seed)
+
+    assert placer.score(placements, dimensions) == reference_score(placements, dimensions)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_net_lengths(pregenerated_cells, random_blif, random_placements, seed):
+    placer, placements, _ = random_state(pregenerated_cells, random_blif, random_placements, seed)
+    store = PlacementStore.from_placements(placements, placer.cell_names)
+
+    net_pins = defaultdict(list)
+    for placement in placements:
+        cell = pregenerated_cells[placement["name"]][placement["turns"]]
+        for pin, net in placement["pins"].iteritems():
+            net_pins[net].append([a + c for a, c in zip(placement["placement"], cell.ports[pin]["coordinates"])])
+
+    expected = [sum(max(c[k] for c in net_pins[net]) - min(c[k] for c in net_pins[net]) for k in xrange(3)) for net in placer.netlist.net_names]
+
+    assert placer.scorer.compute_net_lengths(store).tolist() == expected
+
+def test_stacked_cells(pregenerated_cells, random_blif, reference_score):
+    blif = random_blif(6, 3, 0)
+    placer = GridPlacer(blif, pregenerated_cells, grid_spacing=5)
+    placements = [{"name": cell["name"], "placement": [0, 0, 0], "turns": 0, "pins": cell["pins"]} for cell in blif.cells]
+
+    # All of them overlap, and some stick out of a small layout
+    dimensions = (2, 3, 4)
+    assert placer.score(placements, dimensions) == reference_score(placements, dimensions)
+
+def test_empty_store(pregenerated_cells, random_blif):
+    placer = GridPlacer(random_blif(0, 1, 0), pregenerated_cells)
+    store = PlacementStore.from_placements([], placer.cell_names)
+
+    assert placer.scorer.score(store, (10, 10, 10)) == 0
@@ -0,0 +1,77 @@
+from __future__ import print_function
+
+import random
+
+import numpy as np
+import pytest
+
+from placer import GridPlacer
+from store import PlacementStore
+
+def random_store(pregenerated_cells, random_blif, random_placements, seed):
+    blif = random_blif(20, 8, seed)
+    placer = GridPlacer(blif, pregenerated_cells, grid_spacing=5)
+    _, dimensions = placer.initial_placement()
+    placements = random_placements(placer, blif, dimensions, seed)
+    return placer, placements, PlacementStore.from_placements(placements, placer.cell_names)
+
+@pytest.mark.parametrize("seed", range(3))
+def test_round_trip(pregenerated_cells, random_blif, random_placements, seed):
+    _, placements, store = random_store(pregenerated_cells, random_blif, random_placements, seed)
+
+    assert len(store) == len(placements)
+    assert store.to_placements() == placements
+
+@pytest.mark.parametrize("seed", range(3))
+def test_undo_reverts_every_move(pregenerated_cells, random_blif, random_placements, seed):
+    _, placements, store = random_store(pregenerated_cells, random_blif, random_placements, seed)
+    rng = random.Random(seed)
+
+    # Move some cells more than once, so undo has to restore the oldest state
+    moved = [rng.randrange(len(store)) for _ in xrange(5)]
+    moved += moved[:2]
+    for i in moved:
+        store.move(i, (rng.randrange(50), rng.randrange(50), rng.randrange(50)), rng.randrange(4))
+
+    assert store.moved_cells() == moved
+
+    store.undo()
+
+    assert store.moved_cells() == []
+    assert store.to_placements() == placements
+
+def test_commit_keeps_moves(pregenerated_cells, random_blif, random_placements):
+    _, placements, store = random_store(pregenerated_cells, random_blif, random_placements, 0)
+
+    store.move(0, (1, 2, 3), 1)
+    store.commit()
+    store.undo()
+
+    assert store.anchor(0) == (1, 2, 3)
+    assert store.turns[0] == 1
+    assert store.to_placements()[1:] == placements[1:]
+
+def test_copy_is_independent(pregenerated_cells, random_blif, random_placements):
+    _, placements, store = random_store(pregenerated_cells, random_blif, random_placements, 0)
+
+    copy = store.copy()
+    copy.move(0, (1, 2, 3), (store.turns[0] + 1) % 4)
+
+    assert store.to_placements() == placements
+    assert store.moved_cells() == []
+    assert copy.pins is store.pins
+
+@pytest.mark.parametrize("seed", range(3))
+def test_extents(pregenerated_cells, random_blif, random_placements, seed):
+    placer, placements, store = random_store(pregenerated_cells, random_blif, random_placements, seed)
+
+    lo, hi = store.extents(placer.cell_shapes)
+
+    corners = []
+    for placement in placements:
+        shape = pregenerated_cells[placement["name"]][placement["turns"]].blocks.shape
+        corners.append(placement["placement"])
+        corners.append([a + s for a, s in zip(placement["placement"], shape)])
+
+    assert lo.tolist() == np.min(corners, axis=0).tolist()
+    assert hi.tolist() == np.max(corners, axis=0).tolist()
@@ -0,0 +1,97 @@
+from __future__ import print_function
+
+import heapq
+
+class BucketQueue(object):
+    """
+    BucketQueue is a priority queue of items keyed on integer priorities
+    that never fall below the last priority popped, as in Dial's algorithm
+    (or A* with a consistent estimate), so that both pushing and popping
+    take constant time.
+
+    Items are kept in a circular array of buckets covering the priorities
+    from the last popped up to size more. Items pushed beyond that wait in
+    an overflow heap until the buckets reach them.
+
+    Pushing an item already in the queue with a lower priority moves it to
+    the lower priority (decrease-key); pushing it with a priority no lower
+    leaves it be.
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self.buckets = [[] for _ in xrange(size)]
+        self.current = 0
+        self.priorities = {}
+        self.overflow = []
+
+        # Number of entries in the buckets, including those of items since
+        # moved to a lower priority, which are skipped when they come up
+        self.bucketed = 0
+
+    def __len__(self):
+        return len(self.priorities)
+
+    def push(self, item, priority):
+        current = self.current
+        if priority < current:
+            raise ValueError("Priority {} is below the last popped, {}".format(priority, current))
+
+        priorities = self.priorities
+        old = priorities.get(item)
+        if old is not None and old <= priority:
+            return
+
+        priorities[item] = priority
+        if priority < current + self.size:
+            self.buckets[priority % self.size].append(item)
+            self.bucketed += 1
+        else:
+            heapq.heappush(self.overflow, (priority, item))
+
+    def refill(self):
+        """
+        Move the items of the overflow that the buckets now cover into
+        them.
+        """
+        overflow = self.overflow
+        limit = self.current + self.size
+        while len(overflow) > 0 and overflow[0][0] < limit:
+            priority, item = heapq.heappop(overflow)
+            if self.priorities.get(item) == priority:
+                self.buckets[priority % self.size].append(item)
+                self.bucketed += 1
+
+    def pop(self):
+        """
+        Remove and return the item with the lowest priority, and its
+        priority.
+        """
+        priorities = self.priorities
+        overflow = self.overflow
+        buckets = self.buckets
+        size = self.size
+
+        while True:
+            if len(priorities) == 0:
+                raise IndexError("pop from an empty BucketQueue")
+
+            # Jump ahead to the overflow if the buckets are empty
+            if self.bucketed == 0:
+                while priorities.get(overflow[0][1]) != overflow[0][0]:
+                    heapq.heappop(overflow)
+                self.current = overflow[0][0]
+                self.refill()
+
+            current = self.current
+            while not buckets[current % size]:
+                current += 1
+                if overflow and overflow[0][0] < current + size:
+                    self.current = current
+                    self.refill()
+            self.current = current
+
+            item = buckets[current % size].pop()
+            self.bucketed -= 1
+            if priorities.get(item) == current:
+                del priorities[item]
+                return item, current
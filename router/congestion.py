@@ -0,0 +1,78 @@
+from __future__ import print_function
+
+import numpy as np
+from math import ceil
+
+from keepout import KeepOut
+
+class Congestion(object):
+    """
+    Congestion holds the costs of routing through each location of a
+    layout during negotiated-congestion (PathFinder) routing:
+    - the present cost, present_factor for every location in use that a
+      wire there would transmit to
+    - the history cost, which grows by history_increment every iteration
+      that a wire is left in violation there
+
+    A wire costs (base cost + history cost) * (1 + present cost). The
+    present factor is multiplied by present_growth (rounding up, so that
+    costs stay integers) every iteration, up to present_limit, so that
+    segments which share a location are pushed harder to find their own,
+    while the history cost steers them away from locations that have been
+    contested for long.
+    """
+    def __init__(self, shape, present_factor=1, present_growth=1.3, present_limit=1000, history_increment=1):
+        self.history = np.zeros(shape, dtype=np.int32)
+        self.present_factor = present_factor
+        self.present_growth = present_growth
+        self.present_limit = present_limit
+        self.history_increment = history_increment
+
+    def cost(self, keepout, coord, a, b, base_cost):
+        """
+        Returns the cost of a wire at coord, connecting pins a and b, that
+        would cost base_cost without congestion: (base cost + history
+        cost) * (1 + present cost).
+        """
+        multiplier, offset = self.cost_factors(keepout, coord, a, b)
+        return base_cost * multiplier + offset
+
+    def cost_factors(self, keepout, coord, a, b):
+        """
+        Returns the multiplier and offset that give cost() at coord from
+        any base cost, so that a search can work them out once for each
+        location.
+        """
+        multiplier = 1 + self.present_factor * keepout.conflicts(coord, a, b)
+        return multiplier, int(self.history[coord]) * multiplier
+
+    def update(self, segments, counts):
+        """
+        Charge the history cost of every location of segments (a list of
+        routing segments) where the wire transmits to a location in use,
+        given the number of things occupying each location, and raise the
+        present factor for the next iteration.
+        """
+        shape = np.array(self.history.shape)
+
+        for segment in segments:
+            violation = segment["violation"]
+            contested = violation[counts.flat[violation] > 0]
+            if len(contested) == 0:
+                continue
+
+            a = tuple(segment["pins"][0]["route_coord"])
+            b = tuple(segment["pins"][1]["route_coord"])
+            coords = np.array([coord for coord in segment["net"] if tuple(coord) not in (a, b)], dtype=np.int).reshape((-1, 3))
+
+            # Wire next to any of the contested locations
+            charged = np.zeros(len(coords), dtype=bool)
+            for offset in KeepOut.stencil:
+                neighbours = coords + offset
+                inside = ((neighbours >= 0) & (neighbours < shape)).all(axis=1)
+                flat = np.ravel_multi_index(neighbours[inside].T, self.history.shape)
+                charged[inside] |= np.in1d(flat, contested)
+
+            self.history[tuple(coords[charged].T)] += self.history_increment
+
+        self.present_factor = min(self.present_limit, int(ceil(self.present_factor * self.present_growth)))
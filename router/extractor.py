@@ -23,13 +23,36 @@ class Extractor:
         self.blif = blif
         self.pregenerated_cells = pregenerated_cells
 
-    def extract_net_segment(self, segment, start_pin, stop_pin):
+    def extract_net_segment(self, segment, start_pin, stop_pin, start_strength=13, stop_strength=1):
         """
         Given the coordinates of the path of this net, generate the
         actual wire path, inserting repeaters as needed.
+
+        start_strength is the signal strength at the start of the path, and
+        stop_strength the least it may have at the end. Returns the
+        extracted path and the signal strength at its end.
         """
         print(start_pin, stop_pin)
 
+        # Actually 15, but assume that the gates have a margin of 2.
+        # TODO: have gates define their output signal strength
+        max_output_signal_strength = 13
+        min_input_signal_strength = 1
+
+        net_coords = segment["net"]
+        initial_extraction = self.initial_extraction(segment, start_pin, stop_pin)
+
+        # Split the extraction, determine redundant pieces (namely, the
+        # wire-to-via connections), and then insert repeaters as needed.
+        item, coords, stop_strength = self.split_extraction(initial_extraction, net_coords, start_pin, stop_pin, start_strength, stop_strength)
+
+        return zip(item, coords), stop_strength
+
+    def initial_extraction(self, segment, start_pin, stop_pin):
+        """
+        Returns the pieces (WIRE, UP_VIA or DOWN_VIA) from start_pin, along
+        the path of segment, to stop_pin, before repeaters are placed.
+        """
         def determine_movement(c1, c2):
             y1, z1, x1 = c1
             y2, z2, x2 = c2
@@ -61,37 +84,27 @@ class Extractor:
                 raise ValueError("Unknown connection between {} and {}".format(c1, c2))
                 return None
 
-        # Actually 15, but assume that the gates have a margin of 2.
-        # TODO: have gates define their output signal strength
-        max_output_signal_strength = 13
-        min_input_signal_strength = 1
-
-        def generate_initial_extraction(net):
-            # print(start_pin)
-            # print(net)
-            # print(stop_pin)
+        net = segment["net"]
 
-            # start_pin to 0
+        # start_pin to 0 (a Steiner point is the first location of
+        # the path itself)
+        if tuple(start_pin) == tuple(net[0]):
+            extracted_net = [Extractor.WIRE]
+        else:
             extracted_net = [determine_movement(start_pin, net[0])]
 
-            # (0 to 1) to (n-2 to n-1)
-            for i in xrange(len(net)-1):
-                c1, c2 = net[i], net[i+1]
-                extracted_net.append(determine_movement(c1, c2))
+        # (0 to 1) to (n-2 to n-1)
+        for i in xrange(len(net)-1):
+            c1, c2 = net[i], net[i+1]
+            extracted_net.append(determine_movement(c1, c2))
 
-            # n-1 to stop_pin
+        # n-1 to stop_pin
+        if tuple(net[-1]) == tuple(stop_pin):
+            extracted_net.append(Extractor.WIRE)
+        else:
             extracted_net.append(determine_movement(net[-1], stop_pin))
 
-            return extracted_net
-
-        net_coords = segment["net"]
-        initial_extraction = generate_initial_extraction(net_coords)
-
-        # Split the extraction, determine redundant pieces (namely, the
-        # wire-to-via connections), and then insert repeaters as needed.
-        item, coords = self.split_extraction(initial_extraction, net_coords, start_pin, stop_pin)
-
-        return zip(item, coords)
+        return extracted_net
 
     def place_repeaters(self, extracted_net_subsection, coords, start_coord, stop_coord, start_strength=13, min_strength=1):
         """
@@ -102,25 +115,13 @@ class Extractor:
         wire pieces to place repeaters along.
 
         start_coord and stop_coord are the coordinates of the coordinates
-        immediately before and after (for usage with repeatable()).
+        immediately before and after (for usage with repeater_fits()).
         """
 
         subsection = list(extracted_net_subsection)
 
         print("Starting strength analysis: ", start_coord, start_strength)
 
-        def repeatable(before, after):
-            """
-            A signal can be repeated as long as the block before the
-            repeater and after the repeater form a line in X or Z.
-            """
-            yb, zb, xb = before
-            ya, za, xa = after
-
-            return yb == ya and \
-                ((zb == za and abs(xb - xa) == 2) or \
-                 (xb == xa and abs(zb - za) == 2))
-
         def compute_strength(subsection):
             if subsection == []:
                 return []
@@ -145,17 +146,7 @@ class Extractor:
             repeater_i = strengths.index(min_strength - 1)
 
             while repeater_i >= 0:
-                if repeater_i > 0:
-                    before = coords[repeater_i - 1]
-                else:
-                    before = start_coord
-
-                if repeater_i < len(coords) - 1:
-                    after = coords[repeater_i + 1]
-                else:
-                    after = stop_coord
-
-                if repeatable(before, after):
+                if self.repeater_fits(coords, repeater_i, start_coord, stop_coord):
                     subsection[repeater_i] = Extractor.REPEATER
                     break
                 else:
@@ -170,9 +161,78 @@ class Extractor:
         # print("Placed repeaters:", subsection)
         return subsection, strengths[len(strengths)-1]
 
-    def split_extraction(self, extracted_net, net_coords, start_coord, stop_coord):
+    def repeater_fits(self, coords, i, start_coord, stop_coord):
         """
-        Split up the extracted net based on sections of wire.
+        Returns True if a repeater can take the place of the wire at
+        coords[i], where start_coord and stop_coord are as in
+        place_repeaters().
+
+        A signal can be repeated as long as the block before the repeater
+        and after the repeater form a line in X or Z.
+        """
+        before = coords[i - 1] if i > 0 else start_coord
+        after = coords[i + 1] if i < len(coords) - 1 else stop_coord
+
+        # A repeater on a Steiner point (the first or last location of the
+        # path) would cut off the other branches there
+        if i < len(coords) and tuple(coords[i]) in [tuple(start_coord), tuple(stop_coord)]:
+            return False
+
+        yb, zb, xb = before
+        ya, za, xa = after
+
+        return yb == ya and \
+            ((zb == za and abs(xb - xa) == 2) or \
+             (xb == xa and abs(zb - za) == 2))
+
+    def needed_start_strength(self, segment, start_pin, stop_pin, stop_strength=1):
+        """
+        Returns the least signal strength at start_pin with which
+        extract_net_segment() can carry the signal along segment to
+        stop_pin, ending with at least stop_strength.
+
+        The start strength only matters up to the first via: it has to be
+        enough to reach the end of that wire with the strength needed
+        there, or to reach the first place a repeater fits with that
+        strength less one (where place_repeaters() puts it).
+        """
+        extraction = self.initial_extraction(segment, start_pin, stop_pin)
+        net_coords = segment["net"]
+
+        # The wire up to the first via, which needs a strength of 1 at its
+        # end, or else the whole path
+        end = len(extraction)
+        after = stop_pin
+        min_strength = stop_strength
+        for i in xrange(len(extraction) - 1):
+            if extraction[i] == Extractor.WIRE and extraction[i + 1] in [Extractor.UP_VIA, Extractor.DOWN_VIA]:
+                end = i
+                after = net_coords[i]
+                min_strength = 1
+                break
+
+        if end == 0:
+            return 1
+
+        coords = net_coords[:end]
+        needed = end - 1 + min_strength
+        for i in xrange(1, end):
+            if self.repeater_fits(coords, i, start_pin, after):
+                needed = min(needed, i + min_strength - 1)
+                break
+
+        if needed > 15:
+            raise ValueError("No signal strength at {} reaches {} with strength {}".format(start_pin, stop_pin, stop_strength))
+
+        return needed
+
+    def split_extraction(self, extracted_net, net_coords, start_coord, stop_coord, start_strength=13, stop_strength=1):
+        """
+        Split up the extracted net based on sections of wire, the last of
+        which must end with at least stop_strength.
+
+        Returns the pieces and coordinates of the net, with repeaters
+        placed, and the signal strength at its end.
         """
         split_on = [[Extractor.REPEATER], [Extractor.WIRE, Extractor.UP_VIA], [Extractor.WIRE, Extractor.DOWN_VIA]]
         replacements = [[Extractor.REPEATER], [Extractor.UP_VIA], [Extractor.DOWN_VIA]]
@@ -200,7 +260,8 @@ class Extractor:
                         after = net_coords[curr]
 
                         # Place the repeaters
-                        repeated_subsection, _ = self.place_repeaters(extracted_net[prev:curr], net_coords[prev:curr], before, after)
+                        strength = start_strength if prev == 0 else 13
+                        repeated_subsection, _ = self.place_repeaters(extracted_net[prev:curr], net_coords[prev:curr], before, after, strength)
                         result.append(repeated_subsection)
                         coords.append(net_coords[prev:curr])
 
@@ -219,11 +280,13 @@ class Extractor:
                 curr += 1
 
         # Add the last section, unless it's empty (prev == curr)
-        before = net_coords[prev - 1]
-        result.append(self.place_repeaters(extracted_net[prev:curr], net_coords[prev:curr], before, stop_coord)[0])
+        before = start_coord if prev == 0 else net_coords[prev - 1]
+        strength = start_strength if prev == 0 else 13
+        repeated_subsection, stop_strength = self.place_repeaters(extracted_net[prev:curr], net_coords[prev:curr], before, stop_coord, strength, stop_strength)
+        result.append(repeated_subsection)
         coords.append(net_coords[prev:curr])
 
-        return sum(result, []), sum(coords, [])
+        return sum(result, []), sum(coords, []), stop_strength
 
     def place_blocks(self, extracted_net, layout, pins):
         """
@@ -361,16 +424,46 @@ class Extractor:
     def extract_routing(self, routing):
         """
         Place the wires and vias specified by routing.
+
+        Segments leaving a Steiner point start with the signal strength
+        left at the end of the segment driving it, which comes before them.
+        That segment places repeaters so as to leave at least the strength
+        the segments after it need to place their own.
         """
         routing = deepcopy(routing)
         for net_name, d in routing.iteritems():
-            for segment in d["segments"]:
-                endpoints = segment["pins"]
-                start_pin = endpoints[0]["pin_coord"]
-                stop_pin = endpoints[1]["pin_coord"]
+            # The least signal strength each Steiner point needs, found
+            # from the last segment back
+            needed_strengths = {}
+            for segment in reversed(d["segments"]):
+                start, stop = segment["pins"]
+                if not start.get("is_steiner", False):
+                    continue
 
-                extracted_net = self.extract_net_segment(segment, start_pin, stop_pin)
-                segment["extracted_net"] = [(Extractor.WIRE, start_pin)] + extracted_net + [(Extractor.WIRE, stop_pin)]
+                stop_strength = needed_strengths.get(tuple(stop["pin_coord"]), 1)
+                start_strength = self.needed_start_strength(segment, start["pin_coord"], stop["pin_coord"], stop_strength)
+
+                key = tuple(start["pin_coord"])
+                needed_strengths[key] = max(needed_strengths.get(key, 1), start_strength)
+
+            steiner_strengths = {}
+            for segment in d["segments"]:
+                start, stop = segment["pins"]
+                start_pin = start["pin_coord"]
+                stop_pin = stop["pin_coord"]
+
+                start_strength = steiner_strengths[tuple(start_pin)] if start.get("is_steiner", False) else 13
+                stop_strength = needed_strengths.get(tuple(stop_pin), 1) if stop.get("is_steiner", False) else 1
+                extracted_net, stop_strength = self.extract_net_segment(segment, start_pin, stop_pin, start_strength, stop_strength)
+                if stop.get("is_steiner", False):
+                    steiner_strengths[tuple(stop_pin)] = stop_strength
+
+                # Steiner points are already the ends of the extracted net
+                if not start.get("is_steiner", False):
+                    extracted_net = [(Extractor.WIRE, start_pin)] + extracted_net
+                if not stop.get("is_steiner", False):
+                    extracted_net = extracted_net + [(Extractor.WIRE, stop_pin)]
+                segment["extracted_net"] = extracted_net
 
         return routing
 
@@ -390,7 +483,7 @@ class Extractor:
                 #self.place_blocks(segment["extracted_net"], extracted_layout)
                 total_net += segment["extracted_net"]
                 total_net += [(Extractor.NOOP, (-2,-2,-2))]
-                pins.update(map(lambda p: tuple(p["pin_coord"]), segment["pins"]))
+                pins.update(tuple(p["pin_coord"]) for p in segment["pins"] if not p.get("is_steiner", False))
         self.place_blocks(total_net, extracted_layout, pins)
 
         return extracted_layout
@@ -0,0 +1,151 @@
+from __future__ import print_function
+
+import heapq
+import numpy as np
+
+class GlobalRouter(object):
+    """
+    GlobalRouter routes segments over a coarse grid of square tiles of a
+    layout, tile_size on a side in Z and X, to give each a corridor of
+    tiles for the maze router to search within.
+
+    Between every two tiles beside each other there is room for a number
+    of wires, its capacity: every other one of the locations along their
+    shared border, on each of the given layers, where a wire can cross
+    from one tile to the other without running into a block. Segments are
+    routed from tile to tile (with Dijkstra's algorithm) at a cost of 1
+    for each border crossed, plus a penalty for each wire over capacity
+    there, in a few rounds of negotiated congestion as Congestion does for
+    the maze router, so that the overflow left (the number of wires over
+    capacity across all borders) estimates how congested the layout is.
+    """
+    def __init__(self, blocks, tile_size, layers, present_factor=2, history_increment=1):
+        height, width, length = blocks.shape
+        self.shape = (width, length)
+        self.tile_size = tile_size
+        self.tiles_shape = (-(-width // tile_size), -(-length // tile_size))
+        self.present_factor = present_factor
+        self.history_increment = history_increment
+
+        # Locations a wire (and the stone under it) fits on each layer
+        layers = [y for y in layers if 1 <= y < height]
+        free = (blocks[layers] == 0) & (blocks[[y - 1 for y in layers]] == 0)
+
+        self.capacity = {}
+        self.demand = {}
+        self.history = {}
+
+        tz, tx = self.tiles_shape
+        for i in xrange(tz):
+            for j in xrange(tx):
+                z0, z1 = i * tile_size, min(width, (i + 1) * tile_size)
+                x0, x1 = j * tile_size, min(length, (j + 1) * tile_size)
+
+                # Border with the next tile in Z, and in X
+                if i + 1 < tz:
+                    crossings = free[:, z1 - 1, x0:x1] & free[:, z1, x0:x1]
+                    self.add_edge((i, j), (i + 1, j), int(crossings.sum()) // 2)
+                if j + 1 < tx:
+                    crossings = free[:, z0:z1, x1 - 1] & free[:, z0:z1, x1]
+                    self.add_edge((i, j), (i, j + 1), int(crossings.sum()) // 2)
+
+    def add_edge(self, t, u, capacity):
+        self.capacity[(t, u)] = capacity
+        self.demand[(t, u)] = 0
+        self.history[(t, u)] = 0
+
+    def edge(self, t, u):
+        return (t, u) if t < u else (u, t)
+
+    def tile(self, coord):
+        _, z, x = coord
+        return (z // self.tile_size, x // self.tile_size)
+
+    def neighbours(self, t):
+        i, j = t
+        tz, tx = self.tiles_shape
+        for u in [(i + 1, j), (i - 1, j), (i, j + 1), (i, j - 1)]:
+            if 0 <= u[0] < tz and 0 <= u[1] < tx:
+                yield u
+
+    def edge_cost(self, e):
+        overflow = max(0, self.demand[e] + 1 - self.capacity[e])
+        return 1 + self.history[e] + self.present_factor * overflow
+
+    def route(self, a, b):
+        """
+        Returns the cheapest path of tiles from the tile of a to the tile
+        of b.
+        """
+        start, goal = self.tile(a), self.tile(b)
+
+        costs = {start: 0}
+        backtrace = {start: None}
+        frontier = [(0, start)]
+        while len(frontier) > 0:
+            cost, t = heapq.heappop(frontier)
+            if t == goal:
+                break
+            if cost > costs[t]:
+                continue
+
+            for u in self.neighbours(t):
+                new_cost = cost + self.edge_cost(self.edge(t, u))
+                if u not in costs or new_cost < costs[u]:
+                    costs[u] = new_cost
+                    backtrace[u] = t
+                    heapq.heappush(frontier, (new_cost, u))
+
+        path = [goal]
+        while backtrace[path[-1]] is not None:
+            path.append(backtrace[path[-1]])
+        path.reverse()
+
+        return path
+
+    def add(self, path, amount=1):
+        for t, u in zip(path, path[1:]):
+            self.demand[self.edge(t, u)] += amount
+
+    def route_all(self, pairs, iterations=3):
+        """
+        Route each (a, b) of pairs, returning the path of tiles of each.
+        Every round after the first rips up and routes every path again,
+        with the history cost of every border over capacity raised.
+        """
+        paths = [None] * len(pairs)
+        for iteration in xrange(iterations):
+            for k, (a, b) in enumerate(pairs):
+                if paths[k] is not None:
+                    self.add(paths[k], -1)
+                paths[k] = self.route(a, b)
+                self.add(paths[k])
+
+            if self.overflow == 0:
+                break
+
+            for e, demand in self.demand.iteritems():
+                if demand > self.capacity[e]:
+                    self.history[e] += self.history_increment
+
+        return paths
+
+    @property
+    def overflow(self):
+        return sum(max(0, demand - self.capacity[e]) for e, demand in self.demand.iteritems())
+
+    def corridor(self, paths, margin=2):
+        """
+        Returns a boolean matrix over the layout in Z and X of the tiles of
+        each of paths, each grown by margin locations on every side.
+        """
+        width, length = self.shape
+        size = self.tile_size
+
+        corridor = np.zeros(self.shape, dtype=bool)
+        for path in paths:
+            for i, j in path:
+                corridor[max(0, i * size - margin):min(width, (i + 1) * size + margin),
+                         max(0, j * size - margin):min(length, (j + 1) * size + margin)] = True
+
+        return corridor
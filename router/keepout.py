@@ -0,0 +1,128 @@
+from __future__ import print_function
+
+import numpy as np
+
+class KeepOut(object):
+    """
+    KeepOut tracks which locations of a layout are in use, and for every
+    location, how many of the locations a wire placed there could transmit
+    to are in use. Those are the locations beside it (north, south, east
+    and west) on its own level and on the level below.
+
+    A wire may not be placed where that count is non-zero, except where
+    the only locations in use are the pins it is connecting.
+    """
+
+    # (dy, dz, dx) from a wire to each location it could transmit to
+    stencil = [(dy, dz, dx) for dy in [0, -1] for dz, dx in [(1, 0), (-1, 0), (0, 1), (0, -1)]]
+
+    def __init__(self, usage_matrix):
+        self.usage = usage_matrix != 0
+        self.counts = np.zeros(self.usage.shape, dtype=np.int32)
+
+        for offset in self.stencil:
+            self.add_shifted(self.usage, offset)
+
+    def add_shifted(self, used, offset):
+        """
+        Count the locations of used, a boolean matrix of the same shape as
+        the layout, for every location offset away from them.
+        """
+        dst = []
+        src = []
+        for d, n in zip(offset, used.shape):
+            dst.append(slice(max(0, -d), n - max(0, d)))
+            src.append(slice(max(0, d), n - max(0, -d)))
+
+        self.counts[tuple(dst)] += used[tuple(src)]
+
+    def contains(self, coord):
+        return all(0 <= c < n for c, n in zip(coord, self.usage.shape))
+
+    def add(self, locations):
+        """
+        Mark each of locations, an array of flat indices into the layout,
+        as in use.
+        """
+        # Only locations not already in use change the counts
+        locations = np.asarray(locations, dtype=np.int)
+        locations = np.unique(locations[~self.usage.flat[locations]])
+        if len(locations) == 0:
+            return
+
+        self.usage.flat[locations] = True
+
+        shape = np.array(self.usage.shape)
+        coords = np.array(np.unravel_index(locations, self.usage.shape)).T
+        for offset in self.stencil:
+            neighbours = coords - offset
+            inside = ((neighbours >= 0) & (neighbours < shape)).all(axis=1)
+            np.add.at(self.counts, tuple(neighbours[inside].T), 1)
+
+    def remove(self, locations):
+        """
+        Mark each of locations, an array of flat indices into the layout,
+        as no longer in use.
+        """
+        locations = np.asarray(locations, dtype=np.int)
+        locations = np.unique(locations[self.usage.flat[locations]])
+        if len(locations) == 0:
+            return
+
+        self.usage.flat[locations] = False
+
+        shape = np.array(self.usage.shape)
+        coords = np.array(np.unravel_index(locations, self.usage.shape)).T
+        for offset in self.stencil:
+            neighbours = coords - offset
+            inside = ((neighbours >= 0) & (neighbours < shape)).all(axis=1)
+            np.subtract.at(self.counts, tuple(neighbours[inside].T), 1)
+
+    def conflicts(self, coord, a, b):
+        """
+        Returns the number of locations in use, other than pins a and b,
+        that a wire at coord connecting a and b would transmit to.
+        """
+        if coord == a or coord == b:
+            return 0
+
+        count = self.counts[coord]
+        if count == 0:
+            return 0
+
+        y, z, x = coord
+        for pin in set([a, b]):
+            py, pz, px = pin
+            if (py - y, pz - z, px - x) in self.stencil and self.contains(pin) and self.usage[pin]:
+                count -= 1
+
+        return count
+
+    def count_conflicts(self, coords, a, b):
+        """
+        Returns conflicts() of each of coords, an N x 3 array of (y, z, x)
+        inside the layout, at once.
+        """
+        coords = np.asarray(coords, dtype=np.int).reshape((-1, 3))
+        counts = self.counts[tuple(coords.T)]
+
+        for pin in set([tuple(a), tuple(b)]):
+            if not (self.contains(pin) and self.usage[pin]):
+                continue
+
+            # Locations the pin is on the stencil of
+            offsets = np.array(pin) - coords
+            beside = np.in1d(offsets[:, 0], [0, -1]) & (np.abs(offsets[:, 1:]).sum(axis=1) == 1)
+            counts = counts - beside
+
+        is_pin = ((coords == a).all(axis=1)) | ((coords == b).all(axis=1))
+        counts[is_pin] = 0
+
+        return counts
+
+    def violating(self, coord, a, b):
+        """
+        Returns True if a wire at coord, connecting pins a and b, would
+        transmit to a location in use other than a and b.
+        """
+        return self.conflicts(coord, a, b) > 0
@@ -34,12 +34,22 @@ class MineTime:
                     output_names.append(pin_name)
             return output_names
 
-        def get_segments(net_name, cell_index):
+        def endpoint(pin_info):
             """
-            Get the segments of this net driven by this cell.
+            Identifies where a segment starts or stops: the index of its
+            cell, or the coordinates of a Steiner point.
+            """
+            if pin_info.get("is_steiner", False):
+                return tuple(pin_info["route_coord"])
+            return pin_info["cell_index"]
+
+        def get_segments(net_name, driver):
+            """
+            Get the segments of this net driven by this cell or Steiner
+            point.
             """
             net_segments = routing[net_name]["segments"]
-            driven_segments = [segment for segment in net_segments if segment["pins"][0]["cell_index"] == cell_index]
+            driven_segments = [segment for segment in net_segments if endpoint(segment["pins"][0]) == driver]
             return driven_segments
 
         def dfs(driver_index, visited=[]):
@@ -73,17 +83,24 @@ class MineTime:
                 for output in outputs:
                     driven_net = cell["pins"][output]
 
-                    indices_along_net = [driver]
+                    # Each place along the net, and the delay to it
+                    indices_along_net = [(driver, 0)]
 
                     while len(indices_along_net) > 0:
-                        temp_driver = indices_along_net.pop()
+                        temp_driver, net_delay = indices_along_net.pop()
                         for segment in get_segments(driven_net, temp_driver):
-                            segment_delay = self.compute_net_delay(segment["extracted_net"])
-                            cumulative_delay = delay + cell_delay + segment_delay
+                            segment_delay = net_delay + self.compute_net_delay(segment["extracted_net"])
 
                             # also see other nets driven by this one
-                            driven_cell_index = segment["pins"][1]["cell_index"]
-                            indices_along_net.append(driven_cell_index)
+                            driven_pin = segment["pins"][1]
+                            indices_along_net.append((endpoint(driven_pin), segment_delay))
+
+                            # Steiner points only lead on to more of the net
+                            if driven_pin.get("is_steiner", False):
+                                continue
+
+                            cumulative_delay = delay + cell_delay + segment_delay
+                            driven_cell_index = driven_pin["cell_index"]
 
                             new_exploration = (explore_list[:] + [driven_cell_index], cumulative_delay, path[:] + [cell_name, driven_net])
                             to_explore.append(new_exploration)
@@ -0,0 +1,87 @@
+from __future__ import print_function
+
+import numpy as np
+
+def walk(waypoints):
+    """
+    Returns the path (an N x 3 array of (y, z, x)) through waypoints, each
+    of which differs from the one before it in only one of Z and X, or in
+    Y by a via.
+    """
+    path = [np.array([waypoints[0]], dtype=np.int)]
+    for start, end in zip(waypoints, waypoints[1:]):
+        start = np.array(start, dtype=np.int)
+        end = np.array(end, dtype=np.int)
+        moved = np.flatnonzero(start != end)
+        if len(moved) == 0:
+            continue
+
+        # A via is one step, whatever its height
+        k = moved[0]
+        if k == 0:
+            path.append(end[None, :])
+            continue
+
+        n = abs(end[k] - start[k])
+        leg = np.repeat(start[None, :], n, axis=0)
+        leg[:, k] += np.sign(end[k] - start[k]) * np.arange(1, n + 1)
+        path.append(leg)
+
+    return np.concatenate(path)
+
+def between(lo, hi, count):
+    """
+    Returns up to count values strictly between lo and hi, evenly spread.
+    """
+    lo, hi = min(lo, hi), max(lo, hi)
+    if hi - lo - 1 <= count:
+        return range(lo + 1, hi)
+
+    return sorted(set(np.linspace(lo + 1, hi - 1, count).round().astype(np.int).tolist()))
+
+def pattern_paths(a, b, height, bends=6):
+    """
+    Returns candidate paths (N x 3 arrays of (y, z, x)) from a to b, which
+    must be on the same Y layer:
+    - the two L shapes, going north/south first (as the first choice) or
+      east/west first,
+    - Z shapes, turning at up to bends places in between a and b in each
+      of Z and X,
+    - each of those hopped over to the layer above, by a via one step
+      from a (so that it's approached straight on) and a via down onto b.
+    """
+    ay, az, ax = a
+    by, bz, bx = b
+    if ay != by:
+        return []
+
+    # Corners in (z, x) of each planar shape
+    shapes = [[(bz, ax)], [(az, bx)]]
+    shapes += [[(zm, ax), (zm, bx)] for zm in between(az, bz, bends)]
+    shapes += [[(az, xm), (bz, xm)] for xm in between(ax, bx, bends)]
+
+    paths = []
+    seen = set()
+    for corners in shapes:
+        # Leave out the corners that aren't turns
+        turns = tuple(c for c in corners if c != (az, ax) and c != (bz, bx))
+        if turns in seen:
+            continue
+        seen.add(turns)
+
+        planar = [(az, ax)] + list(turns) + [(bz, bx)]
+        paths.append(walk([(ay, z, x) for z, x in planar]))
+
+        # The same shape on the layer above
+        uy = ay + 3
+        if uy >= height or abs(bz - az) + abs(bx - ax) < 2:
+            continue
+
+        (fz, fx) = planar[1]
+        first = (az + cmp(fz, az), ax + cmp(fx, ax))
+        hopped = [(ay, az, ax), (ay,) + first, (uy,) + first]
+        hopped += [(uy, z, x) for z, x in planar[1:]]
+        hopped.append((by, bz, bx))
+        paths.append(walk(hopped))
+
+    return paths
@@ -1,21 +1,42 @@
 from __future__ import print_function
 
-import heapq
 from copy import deepcopy
 from collections import defaultdict
 import random
+import time
 
 import numpy as np
-from scipy.spatial.distance import cityblock
+from multiprocessing import Pool
 
 from util.blocks import block_names
 
+from bucketqueue import BucketQueue
+from congestion import Congestion
+from globalrouter import GlobalRouter
+from keepout import KeepOut
+from patterns import pattern_paths
+from steiner import rectilinear_steiner_tree
+from usage import UsageGrid
+
 class Router:
+    # Movements between locations while searching, and their costs
+    EAST, NORTH, WEST, SOUTH, UP, DOWN = range(6)
+    planar_movements = [(0, 0, 1), (0, 1, 0), (0, 0, -1), (0, -1, 0)]
+    movements = planar_movements + [(3, 0, 0), (-3, 0, 0)]
+    movement_costs = [1, 1, 1, 1, 3, 3]
+
     def __init__(self, blif, pregenerated_cells):
         self.blif = blif
         self.pregenerated_cells = pregenerated_cells
-        self.cost_matrix = None
-        self.backtrace_matrix = None
+        self.state_costs = None
+        self.state_backtraces = None
+        self.location_stamps = None
+
+        # Search state is only valid where its stamp matches the current
+        # search, so that starting a search doesn't have to clear it
+        self.search_id = 0
+        self.search_stamps = None
+        self.visited_stamps = None
 
     def extract_extended_pin_locations(self, placements):
         """
@@ -25,7 +46,8 @@ class Router:
                         "pin": s,
                         "pin_coord": (y, z, x),
                         "route_coord": (y, z, x),
-                        "is_output": True/False
+                        "is_output": True/False,
+                        "is_steiner": False
                       }
                       ...
                     ]
@@ -77,58 +99,28 @@ class Router:
                                 "pin": pin,
                                 "pin_coord": coord,
                                 "route_coord": extended_coord,
-                                "is_output": is_output}
+                                "is_output": is_output,
+                                "is_steiner": False}
                 net_pins[net_name].append(net_pin_info)
 
         return net_pins
 
-    def create_net_segments(self, pin_locations):
-
-        def minimum_spanning_tree(size, distance_metric):
-            """
-            Compute the segments that form the minimum spanning tree,
-            using Kruskal's algorithm.
-
-            The input is the size of the graph, and the tree is organized
-            as a list of elements, with no gaps. (To be precise,
-            distance_metric(u, v) must be defined for all u, v in [0, size).)
-
-            distance_metric(u, v) is the function that computes the distance
-            between the nodes indexed u and v.
-
-            The output is a list of (i, j) pairs specifying the MST.
-            """
+    def create_net_segments(self, pin_locations, keepout=None):
+        """
+        Decompose each net into segments along a rectilinear Steiner tree
+        of its pins. Steiner points become pseudo-pins of the net, with
+        is_steiner set, a cell_index of None, and both their pin_coord and
+        route_coord at the point. If keepout is given, Steiner points are
+        only placed where wire could go without violating it.
+
+        Returns a dictionary keyed on net names, with the (driver, driven)
+        pairs of pin dictionaries of each segment.
+        """
 
-            # Create sets for each of the pins
-            sets = []
-            for i in xrange(size):
-                s = set([i])
-                sets.append(s)
-
-            # Compute the weight matrix
-            weights = {}
-            for i in xrange(size):
-                for j in xrange(i+1, size):
-                    weights[(i, j)] = distance_metric(i, j)
-
-            def find_set(u):
-                for i, s in enumerate(sets):
-                    if u in s:
-                        return i
-                return -1
-
-            # Create spanning tree!
-            A = set()
-            for u, v in sorted(weights, key=weights.get):
-                u_i = find_set(u)
-                v_i = find_set(v)
-                if u_i != v_i:
-                    A.add((u, v))
-                    # Union the two sets
-                    sets[v_i] |= sets[u_i]
-                    sets.pop(u_i)
-
-            return A
+        def allowed(coord):
+            below = (coord[0] - 1,) + coord[1:]
+            return keepout.contains(below) and keepout.contains(coord) and \
+                not keepout.usage[coord] and not keepout.usage[below] and keepout.counts[coord] == 0
 
         def dag_from_output_mst(graph_connections, pin_list):
             """
@@ -178,96 +170,102 @@ class Router:
             if len(pin_list) < 2:
                 continue
 
-            # Define the metric on the pin list
-            def metric(u, v):
-                coord_u = pin_list[u]["route_coord"]
-                coord_v = pin_list[v]["route_coord"]
-                return cityblock(coord_u, coord_v)
+            coords = [pin_info["route_coord"] for pin_info in pin_list]
+            steiner_points, graph_connections = rectilinear_steiner_tree(coords, allowed if keepout is not None else None)
+
+            pin_list = pin_list + [{"cell_index": None,
+                                    "pin": None,
+                                    "pin_coord": coord,
+                                    "route_coord": coord,
+                                    "is_output": False,
+                                    "is_steiner": True} for coord in map(tuple, steiner_points.tolist())]
 
-            graph_connections = minimum_spanning_tree(len(pin_list), metric)
             dag = dag_from_output_mst(graph_connections, pin_list)
             net_segments[net] = dag
 
         return net_segments
 
-    def dumb_route(self, a, b):
+    def pattern_route(self, a, b, keepout, bends=6):
         """
-        Routes, on one Y layer only, the path between a and b, going
-        east/west, then north/south, ignorant of all intervening objects.
+        Returns the cheapest of the pattern routes between a and b (see
+        pattern_paths()), and the number of its locations in violation of
+        keepout, or (None, None) if there are none.
+
+        Paths cost what maze_route() would make them cost: 1 for each move
+        east, west, north or south, 3 for each via, and a fixed penalty
+        instead for each location in violation. Every location of every
+        candidate is looked up in keepout at once.
         """
-        ay, az, ax = a
-        by, bz, bx = b
+        a = tuple(a)
+        b = tuple(b)
+        paths = pattern_paths(a, b, keepout.usage.shape[0], bends)
+        if len(paths) == 0:
+            return None, None
 
-        net = [a]
-
-        cy, cz, cx = a
-        while cy != by or cz != bz or cx != bx:
-            if cz > bz:
-                cz -= 1
-            elif cz < bz:
-                cz += 1
-            elif cx > bx:
-                cx -= 1
-            elif cx < bx:
-                cx += 1
-            else:
-                raise ValueError("dumb_route cannot route on Y layer")
+        violation_cost = 1000
 
-            coord = (cy, cz, cx)
-            net.append(coord)
+        # Every location after the first of every path, and its path
+        counts = np.array([len(path) - 1 for path in paths], dtype=np.int)
+        coords = np.concatenate([path[1:] for path in paths])
+        path_ids = np.repeat(np.arange(len(paths)), counts)
+        movement_costs = np.concatenate([np.where(np.diff(path[:, 0]) != 0, 3, 1) for path in paths])
 
-        return net
+        violating = keepout.count_conflicts(coords, a, b) > 0
+        costs = np.bincount(path_ids, weights=np.where(violating, violation_cost, movement_costs), minlength=len(paths))
+        violations = np.bincount(path_ids, weights=violating, minlength=len(paths))
+
+        # The first cheapest, so that ties go to the plain L shape
+        best = int(np.argmin(costs))
+        return map(tuple, paths[best].tolist()), int(violations[best])
+
+    def flatten_locations(self, coords, dimensions):
+        """
+        Returns the sorted, distinct flat indices into a layout of the
+        given dimensions of coords, an N x 3 array of (y, z, x), leaving
+        out those outside of the layout.
+        """
+        shape = np.array(dimensions)
+        coords = coords[((coords >= 0) & (coords < shape)).all(axis=1)]
+        return np.unique(np.ravel_multi_index(coords.T, dimensions))
 
     def net_to_wire_and_violation(self, net, dimensions, pins):
         """
         Converts a realized net, which is a list of block positions from
-        one pin to another, into two matrices:
+        one pin to another, into two arrays of flat indices into the
+        layout:
         - wire: the redstone + stone block
         - violation: the places where this redstone may possibly transmit
 
         The net is the list of where the _redstone_ is.
         """
-        wire = np.zeros(dimensions, dtype=np.uint8)
-        violation = np.zeros(dimensions, dtype=np.bool)
-
-        redstone = block_names.index("redstone_wire")
-        stone = block_names.index("stone")
+        net_coords = np.array(net, dtype=np.int).reshape((-1, 3))
 
-        violation_directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+        # Redstone, and the stone below it
+        wire_coords = np.concatenate([net_coords, net_coords - (1, 0, 0)])
+        wire = self.flatten_locations(wire_coords, dimensions)
 
-        for coord in net:
-            y, z, x = coord
-            # Generate the wire itself
-            wire[y, z, x] = redstone
-            wire[y - 1, z, x] = stone
-
-            # Generate the violation matrix, unless it's a pin
-            if coord not in pins:
-                for vy in [0, -1]:
-                    for vz, vx in violation_directions:
-                        try:
-                            violation[y + vy, z + vz, x + vx] = True
-                        except IndexError:
-                            pass
+        # Everywhere beside the wire, unless it's a pin
+        pin_coords = set(tuple(pin) for pin in pins)
+        not_pins = np.array([tuple(coord) not in pin_coords for coord in net], dtype=bool)
+        halo_coords = np.concatenate([net_coords[not_pins] + offset for offset in KeepOut.stencil])
+        violation = self.flatten_locations(halo_coords, dimensions)
 
         # Remove "wire" from the violation matrix so that it doesn't
         # violate itself
-        for y, z, x in net:
-            violation[y, z, x] = False
-            violation[y - 1, z, x] = False
+        violation = np.setdiff1d(violation, wire, assume_unique=True)
 
         return wire, violation
 
-    def compute_net_violations(self, violation, occupieds):
-        """
-        For each non-zero entry, see if there is anything in "occupieds".
+    def initial_routing(self, placements, layout_dimensions, blocks=None):
         """
-        violations = np.logical_and(violation, occupieds)
-        return sum(violations.flat)
+        For all nets, produce an initial routing. Each segment, shortest
+        first, is laid along the cheapest of its pattern routes (see
+        pattern_route()) given the segments laid before it, keeping clear
+        of where every pin will be wired from. The segments left in
+        violation are then maze routed, one at a time.
 
-    def initial_routing(self, placements, layout_dimensions):
-        """
-        For all nets, produce a dumb initial routing.
+        If the blocks of the placed layout are given, the segments (and
+        the Steiner points of nets) are kept clear of them.
 
         The returned routing dictionary is of the structure:
         { net name:
@@ -275,8 +273,8 @@ class Router:
               segments: [
                 { pins: [(ay, az, ax), (by, bz, bx)],
                   net: [path of redstone],
-                  wire: [path of redstone and blocks],
-                  violation: [violation matrix]
+                  wire: [flat indices of redstone and blocks],
+                  violation: [flat indices of where the redstone may transmit]
                 }
               ]
             }
@@ -285,35 +283,98 @@ class Router:
         routings = {}
 
         pin_locations = self.extract_extended_pin_locations(placements)
-        net_segments = self.create_net_segments(pin_locations)
+        route_coords = np.array([pin_info["route_coord"] for pin_list in pin_locations.itervalues() for pin_info in pin_list], dtype=np.int).reshape((-1, 3))
+
+        # Keep Steiner points clear of the cells and of where every pin
+        # will be wired from
+        keepout = None
+        if blocks is not None:
+            keepout = KeepOut(blocks)
+            keepout.add(self.flatten_locations(np.concatenate([route_coords, route_coords - (1, 0, 0)]), layout_dimensions))
+        else:
+            blocks = np.zeros(layout_dimensions, dtype=np.int)
+
+        net_segments = self.create_net_segments(pin_locations, keepout)
 
         for net_name, segment_endpoints in net_segments.iteritems():
-            segments = []
-            for a, b in segment_endpoints:
-                coord_a = a["route_coord"]
-                coord_b = b["route_coord"]
-                net = self.dumb_route(coord_a, coord_b)
-                w, v = self.net_to_wire_and_violation(net, layout_dimensions, [coord_a, coord_b])
-                segment = {"pins": [a, b], "net": net, "wire": w, "violation": v}
-                segments.append(segment)
-
-            net_pins = pin_locations[net_name]
-            routings[net_name] = {"pins": net_pins, "segments": segments}
+            segments = [{"pins": [a, b]} for a, b in segment_endpoints]
+            routings[net_name] = {"pins": pin_locations[net_name], "segments": segments}
+
+        def segment_length(key):
+            net_name, i = key
+            a, b = [pin_info["route_coord"] for pin_info in routings[net_name]["segments"][i]["pins"]]
+            return sum(abs(p - q) for p, q in zip(a, b))
+
+        keys = sorted([(net_name, i) for net_name, d in sorted(routings.iteritems()) for i in xrange(len(d["segments"]))], key=segment_length)
+
+        # Pattern route every segment, while the pins not yet wired are
+        # in use
+        usage = UsageGrid(blocks)
+        reserved = self.flatten_locations(route_coords, layout_dimensions)
+        usage.add(reserved)
+
+        for net_name, i in keys:
+            segment = routings[net_name]["segments"][i]
+            a, b = [pin_info["route_coord"] for pin_info in segment["pins"]]
+            net, _ = self.pattern_route(a, b, usage.keepout)
+            if net is None:
+                continue
+
+            segment["net"] = net
+            segment["wire"], segment["violation"] = self.net_to_wire_and_violation(net, layout_dimensions, [a, b])
+            usage.add(segment["wire"])
+
+        usage.remove(reserved)
+
+        # Maze route the segments without a pattern route, or whose
+        # pattern route is in violation
+        conflicted = []
+        for net_name, i in keys:
+            segment = routings[net_name]["segments"][i]
+            if "net" not in segment or usage.counts.flat[segment["violation"]].any():
+                conflicted.append((net_name, i))
+
+        for net_name, i in conflicted:
+            segment = routings[net_name]["segments"][i]
+            if "wire" in segment:
+                usage.remove(segment["wire"])
+
+            a, b = [pin_info["route_coord"] for pin_info in segment["pins"]]
+            net = self.maze_route(a, b, (blocks, None), usage.counts, usage.keepout)
+
+            segment["net"] = net
+            segment["wire"], segment["violation"] = self.net_to_wire_and_violation(net, layout_dimensions, [a, b])
+            usage.add(segment["wire"])
+
+        print("Pattern routed", len(keys) - len(conflicted), "segments, maze routed", len(conflicted))
 
         return routings
 
     def generate_usage_matrix(self, placed_layout, routing, exclude=[]):
         blocks, _ = placed_layout
-        usage_matrix = np.copy(blocks)
+        usage_matrix = blocks != 0
         for net_name, d in routing.iteritems():
             for i, segment in enumerate(d["segments"]):
                 if (net_name, i) in exclude:
                     continue
                 else:
-                    usage_matrix = np.logical_or(usage_matrix, segment["wire"])
+                    usage_matrix.flat[segment["wire"]] = True
 
         return usage_matrix
 
+    def generate_usage_grid(self, placed_layout, routing):
+        """
+        Returns a UsageGrid of the placed cells and every segment of
+        routing.
+        """
+        blocks, _ = placed_layout
+        usage = UsageGrid(blocks)
+        for net_name, d in routing.iteritems():
+            for segment in d["segments"]:
+                usage.add(segment["wire"])
+
+        return usage
+
     def score_routing(self, routing, usage_matrix):
         """
         For the given layout, and the routing, produce the score of the
@@ -330,39 +391,39 @@ class Router:
         beta = 0.1
         gamma = 1
 
-        net_scores = {}
-        net_num_violations = {}
+        net_scores = dict((net_name, []) for net_name in routing)
+        net_num_violations = dict((net_name, []) for net_name in routing)
 
-        # Score each net segment in the entire net
-        for net_name, d in routing.iteritems():
-            net_scores[net_name] = []
-            net_num_violations[net_name] = []
+        keys = [(net_name, i) for net_name, d in routing.iteritems() for i in xrange(len(d["segments"]))]
+        if len(keys) == 0:
+            return net_scores, net_num_violations
+        segments = [routing[net_name]["segments"][i] for net_name, i in keys]
 
-            for i, segment in enumerate(d["segments"]):
-                routed_net = segment["net"]
-
-                # Violations
-                violation_matrix = segment["violation"]
-                violations = self.compute_net_violations(violation_matrix, usage_matrix)
-                net_num_violations[net_name].append(violations)
+        # Violations: every location next to every segment at once, counted
+        # by segment where it's in use
+        counts = np.array([len(segment["violation"]) for segment in segments], dtype=np.int)
+        locations = np.concatenate([segment["violation"] for segment in segments]).astype(np.int)
+        segment_ids = np.repeat(np.arange(len(segments)), counts)
+        violations = np.bincount(segment_ids[usage_matrix.flat[locations] != 0], minlength=len(segments))
 
-                # Number of vias and pins
-                vias = 0
-                num_pins = 2
-                pins_vias = vias - num_pins
+        # Number of vias and pins
+        vias = 0
+        num_pins = 2
+        pins_vias = vias - num_pins
 
-                # Lower length bound
-                coord_a = segment["pins"][0]["route_coord"]
-                coord_b = segment["pins"][1]["route_coord"]
-                lower_length_bound = max(1, cityblock(coord_a, coord_b))
-                length_ratio = len(routed_net) / lower_length_bound
+        # Ratio of the length to its lower bound
+        lengths = np.array([len(segment["net"]) for segment in segments], dtype=np.int)
+        coords_a = np.array([segment["pins"][0]["route_coord"] for segment in segments], dtype=np.int)
+        coords_b = np.array([segment["pins"][1]["route_coord"] for segment in segments], dtype=np.int)
+        lower_length_bounds = np.maximum(1, np.abs(coords_a - coords_b).sum(axis=1))
+        length_ratios = lengths // lower_length_bounds
 
-                score = (alpha * violations) + (beta * pins_vias) + (gamma * length_ratio)
+        scores = (alpha * violations) + (beta * pins_vias) + (gamma * length_ratios)
 
-                net_scores[net_name].append(score)
+        for (net_name, i), score, num_violations in zip(keys, scores.tolist(), violations.tolist()):
+            net_scores[net_name].append(score)
+            net_num_violations[net_name].append(num_violations)
 
-        # print(routing)
-        # print(net_scores)
         return net_scores, net_num_violations
 
     def normalize_net_scores(self, net_scores, norm_margin=0.1):
@@ -396,194 +457,579 @@ class Router:
 
         return rip_up
 
-    def maze_route(self, a, b, placed_layout, usage_matrix):
+    def global_route(self, routing, placed_layout, tile_size, tree=False, corridor_margin=None):
+        """
+        Route every segment of routing over tiles tile_size on a side (see
+        GlobalRouter), and return the corridor of each: a boolean matrix
+        over the layout in Z and X of the tiles it crosses, grown by
+        corridor_margin (a whole tile if None) on each side, for
+        maze_route() to search within. Corridors are
+        keyed by (net name, index), or by net name if tree is True, in
+        which case each covers every segment of the net.
+        """
+        blocks, _ = placed_layout
+        height, _, _ = blocks.shape
+
+        keys = [(net_name, i) for net_name, d in sorted(routing.iteritems()) for i in xrange(len(d["segments"]))]
+        pairs = [[tuple(pin_info["route_coord"]) for pin_info in routing[net_name]["segments"][i]["pins"]] for net_name, i in keys]
+
+        # Wire may go on the layers of the pins, and those that vias from
+        # them reach
+        pin_layers = set(coord[0] for pair in pairs for coord in pair)
+        layers = sorted(set(y for lowest in pin_layers for y in xrange(lowest, height, 3)))
+
+        if corridor_margin is None:
+            corridor_margin = tile_size
+
+        global_router = GlobalRouter(blocks, tile_size, layers)
+        paths = global_router.route_all(pairs)
+        print("Global routing overflow:", global_router.overflow, "over", len(global_router.capacity), "tile borders")
+
+        if not tree:
+            return dict((key, global_router.corridor([path], corridor_margin)) for key, path in zip(keys, paths))
+
+        net_paths = defaultdict(list)
+        for (net_name, _), path in zip(keys, paths):
+            net_paths[net_name].append(path)
+
+        return dict((net_name, global_router.corridor(paths, corridor_margin)) for net_name, paths in net_paths.iteritems())
+
+    def maze_route(self, a, b, placed_layout, usage_matrix, keepout=None, astar=True, window_margin=8, congestion=None, sources=(), corridor=None):
         """
         Given two pins to re-route, find the best path using Lee's maze
         routing algorithm.
+
+        keepout is the KeepOut of usage_matrix, if one is being kept up to
+        date as segments are routed.
+
+        If congestion is None, wire costs a fixed penalty wherever it is in
+        violation. Otherwise, it costs what the Congestion gives for each
+        location.
+
+        If astar is True, the search is guided towards b by a lower bound
+        on the cost of the rest of the path (its Manhattan distance, with
+        changes in Y made by vias), and stops as soon as b is reached.
+
+        If window_margin is not None, the search only covers the bounding
+        box of a and b (in Z and X), grown by window_margin (at least 1) on
+        each side. If no path is found, the margin is doubled until the
+        window covers the whole layout.
+
+        sources are wire locations, besides a, that the path may start
+        from instead (see tree_route()). The path returned starts from
+        whichever it was found from.
+
+        If corridor (a boolean matrix over the layout in Z and X, see
+        global_route()) is given, the search first covers only the
+        locations within it, and only falls back on the windows above if
+        no path is found there.
         """
         blocks, _ = placed_layout
+        height, width, length = blocks.shape
 
-        def clear_matrices():
-            height, width, length = self.cost_matrix.shape
-            for y in xrange(height):
-                for z in xrange(width):
-                    for x in xrange(length):
-                        self.cost_matrix[y, z, x] = -1
-                        self.backtrace_matrix[y, z, x] = 0
-
-        # If not created yet, create the cost matrices, otherwise, just zero them out
-        if self.cost_matrix is None or self.backtrace_matrix is None:
-            self.cost_matrix = np.full_like(blocks, -1, dtype=np.int)
-            self.backtrace_matrix = np.zeros_like(blocks, dtype=np.int)
-        else:
-            clear_matrices()
-
-        def violating(coord):
-            if coord in [a, b]:
-                return False
-
-            violation_directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]
-            for dy in [0, -1]:
-                for dz, dx in violation_directions:
-                    y, z, x = coord
-                    new_coord = (y + dy, z + dz, x + dx)
-                    if new_coord in [a, b]:
-                        continue
-                    try:
-                        if usage_matrix[new_coord]:
-                            return True
-                    except IndexError:
-                        continue
+        if keepout is None:
+            keepout = KeepOut(usage_matrix)
+
+        if corridor is not None:
+            window = self.corridor_window(corridor, blocks.shape)
+            net = self.maze_search(a, b, blocks, keepout, window, astar, congestion, sources, corridor)
+            if net is not None:
+                return net
+
+        # A margin of 0 would never grow
+        margin = window_margin
+        if margin is not None:
+            margin = max(1, margin)
+
+        while True:
+            window = self.search_window(a, b, blocks.shape, margin)
+
+            net = self.maze_search(a, b, blocks, keepout, window, astar, congestion, sources)
+            if net is not None:
+                return net
+
+            # Give up once the window covers the layout
+            (_, lz, lx), (_, hz, hx) = window
+            if lz == 0 and lx == 0 and hz == width and hx == length:
+                raise ValueError("No path between {} and {} found!".format(a, b))
+
+            margin *= 2
 
-            # Also check how we approach upward vias
-            """if dy > 0:
-                lastpos = self.backtrace_matrix[location]
-                lastdir = (y-lastpos[0], z-lastpos[1], x-lastpos[2])
-                lastpos2 = self.backtrace_matrix[lastpos]
-                lastdir2 = (lastpos[0]-lastpos2[0], lastpos[1]-lastpos2[1], lastpos[2]-lastpos2[2])
-                print("Lastdir=%s, thisdir=%s"%(lastdir, thisdir))
-                if lastdir != lastdir2:
-                    return True"""
-
-            return False
-
-        # Possible list of movements
-        EAST = 1
-        MOVE_EAST = (0, 0, 1)
-        NORTH = 2
-        MOVE_NORTH = (0, 1, 0)
-        WEST = 3
-        MOVE_WEST = (0, 0, -1)
-        SOUTH = 4
-        MOVE_SOUTH = (0, -1, 0)
-        UP = 5
-        MOVE_UP = (3, 0, 0)
-        DOWN = 6
-        MOVE_DOWN = (-3, 0, 0)
-
-        # Backtrace is the way you go from the start.
-        movements = [MOVE_EAST, MOVE_NORTH, MOVE_WEST, MOVE_SOUTH, MOVE_UP, MOVE_DOWN]
-        backtrace_movements = [MOVE_WEST, MOVE_SOUTH, MOVE_EAST, MOVE_NORTH, MOVE_DOWN, MOVE_UP]
-        backtraces = [WEST, SOUTH, EAST, NORTH, DOWN, UP]
-        costs = [1, 1, 1, 1, 3, 3]
+    def search_window(self, a, b, shape, margin):
+        """
+        Returns the window maze_route() first searches between a and b in a
+        layout of the given shape: the lowest (y, z, x) and the highest
+        (exclusive) of the bounding box of a and b in Z and X, grown by
+        margin on each side, or the whole layout if margin is None.
+        """
+        height, width, length = shape
+        if margin is None:
+            return ((0, 0, 0), (height, width, length))
+
+        return ((0, max(0, min(a[1], b[1]) - margin), max(0, min(a[2], b[2]) - margin)),
+                (height, min(width, max(a[1], b[1]) + margin + 1), min(length, max(a[2], b[2]) + margin + 1)))
+
+    def corridor_window(self, corridor, shape):
+        """
+        Returns the window (as for search_window()) of the bounding box of
+        corridor in Z and X, over every Y layer of a layout of the given
+        shape.
+        """
+        height, _, _ = shape
+        zs = np.flatnonzero(corridor.any(axis=1))
+        xs = np.flatnonzero(corridor.any(axis=0))
+        return ((0, int(zs[0]), int(xs[0])), (height, int(zs[-1]) + 1, int(xs[-1]) + 1))
+
+    def maze_search(self, a, b, blocks, keepout, window, astar, congestion=None, sources=(), corridor=None):
+        """
+        Search for a path from a, or any of sources, to b within window, a
+        pair of the lowest (y, z, x) and the highest (exclusive) of the
+        region to search, and within corridor (if given), as in
+        maze_route(), avoiding the locations kept out by keepout (at the
+        cost given by congestion, if any).
+
+        The search is over states of a location and the movement the path
+        arrived there by, so that the approach to an upward via is part of
+        the state: a via taken straight on from two moves in the same
+        direction is one transition (the second of those moves, and the
+        via), and no other upward via is taken, apart from one straight up
+        from where the path starts.
+
+        Returns the path, or None if b cannot be reached.
+        """
+        (ly, lz, lx), (hy, hz, hx) = window
+        height, width, length = blocks.shape
+        a = tuple(a)
+        b = tuple(b)
+
+        # States are numbered (flat index of the location) * 6 + (movement
+        # arrived by)
+        num_directions = len(Router.movements)
+        area = width * length
+        offsets = [dy * area + dz * length + dx for dy, dz, dx in Router.movements]
+        up_offset = offsets[Router.UP]
+        up_cost = Router.movement_costs[Router.UP]
+
+        # If not created yet, create the search state, otherwise, just move
+        # on to a new stamp
+        if self.state_costs is None or len(self.location_stamps) != blocks.size:
+            num_states = blocks.size * num_directions
+            self.state_costs = [0] * num_states
+            self.state_backtraces = [0] * num_states
+            self.search_stamps = [0] * num_states
+            self.visited_stamps = [0] * num_states
+            self.location_stamps = [0] * blocks.size
+            self.expanded_stamps = [0] * blocks.size
+            self.location_multipliers = [0] * blocks.size
+            self.location_offsets = [0] * blocks.size
+            self.search_id = 0
+
+        self.search_id += 1
+        search_id = self.search_id
+        state_costs = self.state_costs
+        state_backtraces = self.state_backtraces
+        search_stamps = self.search_stamps
+        visited_stamps = self.visited_stamps
+        location_stamps = self.location_stamps
+        expanded_stamps = self.expanded_stamps
+        location_multipliers = self.location_multipliers
+        location_offsets = self.location_offsets
+
+        by, bz, bx = b
+
+        # Whether each location in Z and X is in the corridor
+        allowed = corridor.ravel().tolist() if corridor is not None else None
+
+        def estimate(y, z, x):
+            """
+            A lower bound on the cost of a path from (y, z, x) to b: every
+            step in Z or X costs 1, and every 3 steps in Y take a via
+            costing 3.
+            """
+            if not astar:
+                return 0
+            dy = abs(y - by)
+            return abs(z - bz) + abs(x - bx) + 3 * ((dy + 2) // 3)
 
         violation_cost = 1000
 
-        # Start breadth-first with a
-        visited = np.zeros_like(blocks, dtype=bool)
-        heap_locations = np.zeros_like(blocks, dtype=bool)
-        min_dist_heap = []
-        self.cost_matrix[a] = 0
-        heapq.heappush(min_dist_heap, (0, a))
-        heap_locations[a] = 1
-
-        visited_size = sum(visited.flat != 0)
-
-        while len(min_dist_heap) > 0:
-            # print("{} -> {}".format(len(to_visit), len(visited)))
-            _, location = heapq.heappop(min_dist_heap)
-            heap_locations[location] = 0
-            visited[location] = 1
-
-            # For each candidate movement
-            for movement, backtrace, movement_cost in zip(movements, backtraces, costs):
-                dy, dz, dx = movement
-                y, z, x = location
-                new_location = (y + dy, z + dz, x + dx)
-
-                try:
-                    # less-than-zero checks
-                    if y + dy < 0 or z + dz < 0 or x + dx < 0:
-                        continue
+        def load_location(location, index):
+            """
+            Work out the cost of a wire at location, with flat index index,
+            as (movement cost) * multiplier + offset.
+            """
+            if congestion is not None:
+                multiplier, offset = congestion.cost_factors(keepout, location, a, b)
+            elif keepout.violating(location, a, b):
+                multiplier, offset = 0, violation_cost
+            else:
+                multiplier, offset = 1, 0
+
+            location_stamps[index] = search_id
+            location_multipliers[index] = multiplier
+            location_offsets[index] = offset
+
+        # Start breadth-first with a and the other sources, as though they
+        # were arrived at by a via, so that no approach from them counts as
+        # straight. The queue is ordered by the cost so far plus the
+        # estimate of the rest, which never decreases along a path, and a
+        # state is moved up if a cheaper path to it is found.
+        sources = set(sources)
+        sources.discard(a)
+        frontier = BucketQueue()
+        push = frontier.push
+        pop = frontier.pop
+        source_indices = set()
+        for source in [a] + list(sources):
+            y, z, x = source
+            source_indices.add(y * area + z * length + x)
+            state = (y * area + z * length + x) * num_directions + Router.UP
+            state_costs[state] = 0
+            state_backtraces[state] = -1
+            search_stamps[state] = search_id
+            push(state, estimate(y, z, x))
+
+        moves = zip(xrange(num_directions), Router.movements, offsets, Router.movement_costs)
+
+        goal = None
+        while len(frontier) > 0:
+            state, _ = pop()
+            visited_stamps[state] = search_id
+
+            index, arrival = divmod(state, num_directions)
+            y, rest = divmod(index, area)
+            z, x = divmod(rest, length)
+            if y == by and z == bz and x == bx:
+                goal = state
+                break
+
+            location_cost = state_costs[state]
+            is_start = state_backtraces[state] == -1
+            is_source = is_start and (y, z, x) != a
+
+            # Only the moves from the first (and cheapest) state of a
+            # location to be expanded matter, apart from carrying straight
+            # on into a via, which depends on the way it was arrived at
+            only_via = expanded_stamps[index] == search_id
+            if only_via:
+                if arrival >= len(Router.planar_movements):
+                    continue
+                expansion = moves[arrival:arrival + 1]
+            else:
+                expanded_stamps[index] = search_id
+                expansion = moves
 
-                    if visited[new_location] == 1:
-                        continue
+            for direction, (dy, dz, dx), offset, movement_cost in expansion:
+                ny, nz, nx = y + dy, z + dz, x + dx
 
-                    # We have to approach upward vias in a straight-path fashion
-                    is_not_straight = False
-                    if dy > 0 and location != a:
-                        #print("Hello?")
-                        entry = self.backtrace_matrix[location]
-                        lastmov = backtrace_movements[backtraces.index(entry)]
-                        lastpos = (lastmov[0]+location[0], lastmov[1]+location[1], lastmov[2]+location[2])
-
-                        entry2 = self.backtrace_matrix[lastpos]
-                        if entry2 > 0:
-                            lastmov2 = backtrace_movements[backtraces.index(entry2)]
-
-                            #lastpos = movements[backtraces.index(entry)]
-                            #lastdir = (y-lastpos[0], z-lastpos[1], x-lastpos[2])
-                            #lastpos2 = movements[backtraces.index(self.backtrace_matrix[lastpos])]
-                            #lastdir2 = (lastpos[0]-lastpos2[0], lastpos[1]-lastpos2[1], lastpos[2]-lastpos2[2])
-                            #print("Lastdir=%s, thisdir=%s"%(lastdir, lastdir2))
-                            #print("Lastmov=%s, lastmov2=%s"%(lastmov, lastmov2))
-                            if lastmov != lastmov2:
-                                #print("Via at (%d,%d) is not straight-on"%(location[1], location[2]))
-                                is_not_straight = True
-
-                    if violating(new_location):
-                        new_location_cost = self.cost_matrix[location] + violation_cost
-                    else:
-                        new_location_cost = self.cost_matrix[location] + movement_cost
-                    if is_not_straight:
-                        new_location_cost += 100
-
-                    # print(location, cost_matrix[location], "->", new_location, cost_matrix[new_location], new_location_cost)
-                    if self.cost_matrix[new_location] == -1 or new_location_cost < self.cost_matrix[new_location]:
-                        self.cost_matrix[new_location] = new_location_cost
-                        self.backtrace_matrix[new_location] = backtrace
-
-                    if heap_locations[new_location] == 0:
-                        heapq.heappush(min_dist_heap, (new_location_cost, new_location))
-                        heap_locations[new_location] = 1
-
-                except IndexError:
+                # Stay inside the window, and the corridor
+                if not (ly <= ny < hy and lz <= nz < hz and lx <= nx < hx):
+                    continue
+                if allowed is not None and dy == 0 and not allowed[nz * length + nx]:
                     continue
 
+                # Branches leave the wire they start from sideways, as a
+                # via would take the place of the wire
+                if dy != 0 and is_source:
+                    continue
+
+                # We have to approach upward vias in a straight-path
+                # fashion, which this isn't (or it would have been taken
+                # with the move before it)
+                if dy > 0 and not is_start:
+                    continue
+
+                # Paths only start from the wire already there, rather
+                # than running along it
+                new_index = index + offset
+                if new_index in source_indices:
+                    continue
+
+                if location_stamps[new_index] != search_id:
+                    load_location((ny, nz, nx), new_index)
+                new_cost = location_cost + movement_cost * location_multipliers[new_index] + location_offsets[new_index]
+
+                # Carry straight on into an upward via
+                if dy == 0 and (arrival == direction or is_start) and ny + 3 < hy:
+                    via_index = new_index + up_offset
+                    via_state = via_index * num_directions + Router.UP
+                    if visited_stamps[via_state] != search_id and via_index not in source_indices:
+                        if location_stamps[via_index] != search_id:
+                            load_location((ny + 3, nz, nx), via_index)
+                        via_cost = new_cost + up_cost * location_multipliers[via_index] + location_offsets[via_index]
+                        if search_stamps[via_state] != search_id or via_cost < state_costs[via_state]:
+                            state_costs[via_state] = via_cost
+                            state_backtraces[via_state] = state
+                            search_stamps[via_state] = search_id
+                            push(via_state, via_cost + estimate(ny + 3, nz, nx))
+
+                if only_via:
+                    continue
+
+                new_state = new_index * num_directions + direction
+                if visited_stamps[new_state] == search_id:
+                    continue
+                if search_stamps[new_state] != search_id or new_cost < state_costs[new_state]:
+                    state_costs[new_state] = new_cost
+                    state_backtraces[new_state] = state
+                    search_stamps[new_state] = search_id
+                    push(new_state, new_cost + estimate(ny, nz, nx))
 
         # Backtrace, if a path found
-        if visited[b] == 1:
-            net = [b] # Don't include b in the route
-            while net[-1] != a:
-                last = net[-1]
-                backtrace_entry = self.backtrace_matrix[last]
-                if backtrace_entry == 0 or backtrace_entry > 6:
-                    raise ValueError("Unknown backtrace entry {}".format(backtrace_entry))
-                movement = backtrace_movements[backtraces.index(backtrace_entry)]
-                dy, dz, dx = movement
-                y, z, x = net[-1]
-                back_location = (y + dy, z + dz, x + dx)
-                net.append(back_location)
-
-            print("Net score:", self.cost_matrix[b], " Length:", len(net))
-            net.reverse()
-            return net
-        else:
-            raise ValueError("No path between {} and {} found!".format(a, b))
-            # print(cost_matrix[1])
-            # print(backtrace_matrix[1])
+        if goal is None:
             return None
 
-    def re_route(self, initial_routing, placed_layout):
+        def location_of(state):
+            y, rest = divmod(state // num_directions, area)
+            return (y,) + divmod(rest, length)
+
+        net = [b]
+        state = goal
+        while state_backtraces[state] != -1:
+            state = state_backtraces[state]
+            back_location = location_of(state)
+
+            # Put back the location between a straight move and its via
+            last = net[-1]
+            if back_location[0] != last[0] and back_location[1:] != last[1:]:
+                net.append((back_location[0],) + last[1:])
+
+            net.append(back_location)
+
+        print("Net score:", state_costs[goal], " Length:", len(net))
+        net.reverse()
+        return net
+
+    def tree_route(self, endpoints, placed_layout, usage_matrix, keepout, congestion=None, corridor=None):
+        """
+        Route one net as a tree. Each (driver, driven) pair of pin
+        dictionaries of endpoints is routed in turn to the driven pin from
+        wherever is nearest on the wire already routed for the net, rather
+        than from the driver alone. None of the net's wire may be in
+        usage_matrix or keepout.
+
+        Where a segment branches from the middle of another, that one is
+        split in two at a new Steiner point. Returns the segments of the
+        net, each before the segments it drives.
+
+        If corridor is given, the net is searched for within it first (see
+        maze_route()).
+        """
+        blocks, _ = placed_layout
+        shape = blocks.shape
+
+        segments = []
+
+        # Where segments may branch from, and the segment and position
+        # along its net of each
+        taps = {}
+
+        def add_taps(segment):
+            net = segment["net"]
+            for j, coord in enumerate(net):
+                # The ends of a via aren't wire
+                if j > 0 and abs(net[j - 1][0] - coord[0]) == 3:
+                    continue
+                if j < len(net) - 1 and abs(net[j + 1][0] - coord[0]) == 3:
+                    continue
+                taps[coord] = (segment, j)
+
+        for pin_info_a, pin_info_b in endpoints:
+            a = tuple(pin_info_a["route_coord"])
+            b = tuple(pin_info_b["route_coord"])
+            net = self.maze_route(a, b, placed_layout, usage_matrix, keepout, congestion=congestion, sources=taps.keys(), corridor=corridor)
+
+            tap = net[0]
+            if tap != a:
+                parent, j = taps[tap]
+                if j == 0:
+                    pin_info_a = parent["pins"][0]
+                elif j == len(parent["net"]) - 1:
+                    pin_info_a = parent["pins"][1]
+                else:
+                    pin_info_a = {"cell_index": None,
+                                  "pin": None,
+                                  "pin_coord": tap,
+                                  "route_coord": tap,
+                                  "is_output": False,
+                                  "is_steiner": True}
+
+                    # The rest of the parent segment now starts at the tap
+                    rest = {"pins": [pin_info_a, parent["pins"][1]], "net": parent["net"][j:]}
+                    parent["pins"] = [parent["pins"][0], pin_info_a]
+                    parent["net"] = parent["net"][:j + 1]
+
+                    k = next(k for k, segment in enumerate(segments) if segment is parent)
+                    segments.insert(k + 1, rest)
+                    for jj, coord in enumerate(rest["net"]):
+                        if coord in taps:
+                            taps[coord] = (rest, jj)
+
+            segment = {"pins": [pin_info_a, pin_info_b], "net": net}
+            segments.append(segment)
+            add_taps(segment)
+
+        for segment in segments:
+            a, b = [pin_info["route_coord"] for pin_info in segment["pins"]]
+            segment["wire"], segment["violation"] = self.net_to_wire_and_violation(segment["net"], shape, [a, b])
+
+        return segments
+
+    def route_in_batches(self, routing, keys, placed_layout, usage, pool=None, window_margin=8, corridors=None):
+        """
+        Route the (net name, index) segments of keys, which are not in
+        usage, in batches whose search windows don't overlap. The segments
+        of a batch are routed at once by routing_worker(), in pool (if not
+        None), against usage as it was when the batch began. If corridors
+        (see global_route()) are given, each segment's search window is cut
+        down to that of its corridor.
+
+        Each new segment is then added to usage in turn, unless it touches
+        a segment added before it from the same batch, in which case it is
+        routed again in a later batch.
+        """
+        blocks, _ = placed_layout
+        shape = blocks.shape
+
+        def overlap(window, other):
+            (lo, hi), (other_lo, other_hi) = window, other
+            return all(l < other_h and other_l < h for l, h, other_l, other_h in zip(lo, hi, other_lo, other_hi))
+
+        queue = list(keys)
+        batches = 0
+        requeued = 0
+
+        while len(queue) > 0:
+            # Pick segments whose windows, and the locations next to them,
+            # don't overlap
+            batch = []
+            windows = []
+            rest = []
+            for net_name, i in queue:
+                pin_info_a, pin_info_b = routing[net_name]["segments"][i]["pins"]
+                corridor = corridors[(net_name, i)] if corridors is not None else None
+                if corridor is not None:
+                    lo, hi = self.corridor_window(corridor, shape)
+                else:
+                    lo, hi = self.search_window(pin_info_a["route_coord"], pin_info_b["route_coord"], shape, window_margin)
+                window = (tuple(l - 1 for l in lo), tuple(h + 1 for h in hi))
+                if any(overlap(window, other) for other in windows):
+                    rest.append((net_name, i))
+                else:
+                    batch.append((net_name, i))
+                    windows.append(window)
+
+            jobs = []
+            for net_name, i in batch:
+                pin_info_a, pin_info_b = routing[net_name]["segments"][i]["pins"]
+                corridor = corridors[(net_name, i)] if corridors is not None else None
+                jobs.append((pin_info_a["route_coord"], pin_info_b["route_coord"], window_margin, corridor))
+
+            if pool is not None:
+                results = pool.map(routing_worker, jobs)
+            else:
+                results = map(routing_worker, jobs)
+
+            # Commit the new segments that don't touch each other
+            committed_wire = np.zeros(0, dtype=np.int)
+            committed_violation = np.zeros(0, dtype=np.int)
+            conflicted = []
+            for (net_name, i), (a, b, _, _), new_net in zip(batch, jobs, results):
+                w, v = self.net_to_wire_and_violation(new_net, shape, [a, b])
+
+                if np.in1d(np.concatenate([w, v]), committed_wire).any() or np.in1d(w, committed_violation).any():
+                    conflicted.append((net_name, i))
+                    continue
+
+                segment = routing[net_name]["segments"][i]
+                segment["net"] = new_net
+                segment["wire"] = w
+                segment["violation"] = v
+                usage.add(w)
+
+                committed_wire = np.concatenate([committed_wire, w])
+                committed_violation = np.concatenate([committed_violation, v])
+
+            # Conflicted segments go first in the next batch, so that they
+            # are sure to be committed then
+            queue = conflicted + rest
+            batches += 1
+            requeued += len(conflicted)
+
+        print("Routed", len(keys), "segments in", batches, "batches,", requeued, "re-queued")
+
+    def snapshot_routing(self, routing):
+        """
+        Returns a copy of the segments of every net of routing, which
+        shares their paths and arrays of flat indices with routing (as
+        those are replaced as segments are routed, rather than changed).
+        """
+        return dict((net_name, [dict(segment) for segment in d["segments"]]) for net_name, d in routing.iteritems())
+
+    def restore_routing(self, routing, snapshot):
+        """
+        Put back the segments of a snapshot_routing() of routing.
+        """
+        for net_name, segments in snapshot.iteritems():
+            routing[net_name]["segments"] = segments
+
+    def re_route(self, initial_routing, placed_layout, workers=1, tree=False, tile_size=None, iterations=None, time_limit=None, stagnation_limit=None):
         """
         re_route() produces new routings until there are no more net
-        violations that cause the routing to be infeasible.
+        violations that cause the routing to be infeasible, or it runs out
+        of iterations or of time_limit (in seconds), or stagnation_limit
+        iterations go by without fewer violations than the fewest so far
+        (for each that isn't None). The routing with the fewest violations
+        seen is returned, even if interrupted.
+
+        If workers is more than 1, the segments ripped up in each iteration
+        are routed in batches across that many processes (see
+        route_in_batches()).
+
+        If tree is True, the whole net of every segment ripped up is routed
+        again as a tree (see tree_route()), one net at a time, along the
+        segments of its initial routing.
+
+        If tile_size is given, every segment (or net) is first routed over
+        tiles tile_size on a side, and re-routed within the corridor found
+        for it (see global_route()).
         """
-        usage_matrix = self.generate_usage_matrix(placed_layout, initial_routing)
+        routing = deepcopy(initial_routing)
+        usage = self.generate_usage_grid(placed_layout, routing)
+        endpoints = dict((net_name, [segment["pins"] for segment in d["segments"]]) for net_name, d in routing.iteritems())
+
+        corridors = defaultdict(lambda: None)
+        if tile_size is not None:
+            corridors.update(self.global_route(routing, placed_layout, tile_size, tree))
+
+        pool = None
+        if workers > 1 and not tree:
+            shape, buffers = usage.share()
+            pool = Pool(workers, init_routing_worker, (self, placed_layout, shape, buffers))
 
         # Score the initial routing
-        net_scores, net_violations = self.score_routing(initial_routing, usage_matrix)
+        net_scores, net_violations = self.score_routing(routing, usage.counts)
         num_violations = sum(sum(net_violations.itervalues(), []))
-        iterations = 0
+        iteration = 0
 
-        routing = deepcopy(initial_routing)
+        best = self.snapshot_routing(routing)
+        best_violations = num_violations
+        best_iteration = 0
+        start_time = time.time()
 
         blocks, _ = placed_layout
         shape = blocks.shape
 
         try:
             while num_violations > 0:
-                print("Iteration:", iterations, " Violations:", num_violations)
+                if iterations is not None and iteration >= iterations:
+                    break
+                if time_limit is not None and time.time() - start_time >= time_limit:
+                    break
+                if stagnation_limit is not None and iteration - best_iteration >= stagnation_limit:
+                    break
+
+                print("Iteration:", iteration, " Violations:", num_violations)
 
                 # Normalize net scores
                 normalized_scores = self.normalize_net_scores(net_scores)
@@ -591,39 +1037,146 @@ class Router:
                 # Select nets to rip-up and re-route
                 rip_up = self.natural_selection(normalized_scores)
 
-                # Re-route these nets
-                usage_matrix = self.generate_usage_matrix(placed_layout, routing, exclude=rip_up)
+                # Rip them up
+                if tree:
+                    rip_up = sorted(set(net_name for net_name, _ in rip_up), key=lambda x: max(normalized_scores[x]), reverse=True)
+                    for net_name in rip_up:
+                        for segment in routing[net_name]["segments"]:
+                            usage.remove(segment["wire"])
+                else:
+                    rip_up = sorted(rip_up, key=lambda x: normalized_scores[x[0]][x[1]], reverse=True)
+                    for net_name, i in rip_up:
+                        usage.remove(routing[net_name]["segments"][i]["wire"])
 
+                # Re-route these nets
                 print("Re-routing", len(rip_up), "nets")
-                for net_name, i in sorted(rip_up, key=lambda x: normalized_scores[x[0]][x[1]], reverse=True):
-                    pin_info_a, pin_info_b = routing[net_name]["segments"][i]["pins"]
-                    a = pin_info_a["route_coord"]
-                    b = pin_info_b["route_coord"]
-                    new_net = self.maze_route(a, b, placed_layout, usage_matrix)
-                    routing[net_name]["segments"][i]["net"] = new_net
+                if tree:
+                    for net_name in rip_up:
+                        segments = self.tree_route(endpoints[net_name], placed_layout, usage.counts, usage.keepout, corridor=corridors[net_name])
+                        routing[net_name]["segments"] = segments
+                        for segment in segments:
+                            usage.add(segment["wire"])
+                elif pool is not None:
+                    self.route_in_batches(routing, rip_up, placed_layout, usage, pool, corridors=corridors)
+                else:
+                    for net_name, i in rip_up:
+                        pin_info_a, pin_info_b = routing[net_name]["segments"][i]["pins"]
+                        a = pin_info_a["route_coord"]
+                        b = pin_info_b["route_coord"]
+                        new_net = self.maze_route(a, b, placed_layout, usage.counts, usage.keepout, corridor=corridors[(net_name, i)])
+                        routing[net_name]["segments"][i]["net"] = new_net
 
-                    w, v = self.net_to_wire_and_violation(new_net, shape, [a, b])
-                    routing[net_name]["segments"][i]["wire"] = w
-                    routing[net_name]["segments"][i]["violation"] = v
+                        w, v = self.net_to_wire_and_violation(new_net, shape, [a, b])
+                        routing[net_name]["segments"][i]["wire"] = w
+                        routing[net_name]["segments"][i]["violation"] = v
 
-                    # Re-add this net to the usage matrix
-                    usage_matrix = np.logical_or(usage_matrix, w)
+                        # Re-add this net to the usage grid
+                        usage.add(w)
 
                 # Re-score this net
-                net_scores, net_violations = self.score_routing(routing, usage_matrix)
+                net_scores, net_violations = self.score_routing(routing, usage.counts)
+                num_violations = sum(sum(net_violations.itervalues(), []))
+                iteration += 1
+
+                if num_violations < best_violations:
+                    best = self.snapshot_routing(routing)
+                    best_violations = num_violations
+                    best_iteration = iteration
+                print()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        print("Rip-up and re-route stopped after", iteration, "iterations, keeping iteration", best_iteration, "with", best_violations, "violations")
+        self.restore_routing(routing, best)
+
+        return routing
+
+    def negotiated_route(self, initial_routing, placed_layout, iterations=100, present_factor=1, present_growth=1.3, history_increment=1, tree=False, tile_size=None):
+        """
+        negotiated_route() produces new routings by negotiated congestion
+        (PathFinder): every iteration rips up and re-routes every segment,
+        with wire costing more where it would transmit to wire already in
+        use (see Congestion), until there are no more net violations or
+        after the given number of iterations.
+
+        If tree is True, every net is routed as a tree instead (see
+        tree_route()), along the segments of its initial routing.
+
+        If tile_size is given, every segment (or net) is first routed over
+        tiles tile_size on a side, and re-routed within the corridor found
+        for it (see global_route()).
+        """
+        routing = deepcopy(initial_routing)
+        usage = self.generate_usage_grid(placed_layout, routing)
+        endpoints = dict((net_name, [segment["pins"] for segment in d["segments"]]) for net_name, d in routing.iteritems())
+
+        corridors = defaultdict(lambda: None)
+        if tile_size is not None:
+            corridors.update(self.global_route(routing, placed_layout, tile_size, tree))
+
+        blocks, _ = placed_layout
+        shape = blocks.shape
+        congestion = Congestion(shape, present_factor, present_growth, history_increment=history_increment)
+
+        segment_keys = [(net_name, i) for net_name, d in sorted(routing.iteritems()) for i in xrange(len(d["segments"]))]
+
+        # Score the initial routing
+        net_scores, net_violations = self.score_routing(routing, usage.counts)
+        num_violations = sum(sum(net_violations.itervalues(), []))
+        iteration = 0
+
+        try:
+            while num_violations > 0 and iteration < iterations:
+                print("Iteration:", iteration, " Violations:", num_violations, " Present factor:", congestion.present_factor)
+
+                if tree:
+                    for net_name in sorted(routing):
+                        for segment in routing[net_name]["segments"]:
+                            usage.remove(segment["wire"])
+
+                        segments = self.tree_route(endpoints[net_name], placed_layout, usage.counts, usage.keepout, congestion, corridors[net_name])
+                        routing[net_name]["segments"] = segments
+                        for segment in segments:
+                            usage.add(segment["wire"])
+
+                else:
+                    for net_name, i in segment_keys:
+                        segment = routing[net_name]["segments"][i]
+                        usage.remove(segment["wire"])
+
+                        pin_info_a, pin_info_b = segment["pins"]
+                        a = pin_info_a["route_coord"]
+                        b = pin_info_b["route_coord"]
+                        new_net = self.maze_route(a, b, placed_layout, usage.counts, usage.keepout, congestion=congestion, corridor=corridors[(net_name, i)])
+
+                        w, v = self.net_to_wire_and_violation(new_net, shape, [a, b])
+                        segment["net"] = new_net
+                        segment["wire"] = w
+                        segment["violation"] = v
+                        usage.add(w)
+
+                congestion.update([segment for net_name, d in sorted(routing.iteritems()) for segment in d["segments"]], usage.counts)
+
+                net_scores, net_violations = self.score_routing(routing, usage.counts)
                 num_violations = sum(sum(net_violations.itervalues(), []))
-                iterations += 1
+                iteration += 1
                 print()
         except KeyboardInterrupt:
             pass
 
+        print("Negotiation stopped after", iteration, "iterations with", num_violations, "violations")
+
         return routing
 
     def serialize_routing(self, original_routing, shape, f):
         """
-        Return the routing without the wire or the violation matrices
-        (which can't be serialized as-is and takes too much space
-        anyway).
+        Return the routing without the wire or the violation locations
+        (which can't be serialized as-is, and can be recomputed from the
+        net).
         """
         import json
         routing = deepcopy(original_routing)
@@ -644,9 +1197,29 @@ class Router:
             for i, segment in enumerate(net["segments"]):
                 a, b = segment["pins"]
                 n = segment["net"]
-                w, v = self.net_to_wire_and_violation(n, shape, [a, b])
+                w, v = self.net_to_wire_and_violation(n, shape, [a["route_coord"], b["route_coord"]])
                 segment["wire" ] = w
                 segment["violation"] = v
 
         return routing
 
+
+# Router, layout and usage grid shared with the processes of
+# Router.route_in_batches()
+worker_router = None
+worker_layout = None
+worker_usage = None
+
+def init_routing_worker(router, placed_layout, shape, buffers):
+    global worker_router, worker_layout, worker_usage
+    worker_router = router
+    worker_layout = placed_layout
+    worker_usage = UsageGrid.from_shared(shape, buffers)
+
+def routing_worker(job):
+    """
+    Route one segment of a batch of Router.route_in_batches(), returning
+    its path.
+    """
+    a, b, window_margin, corridor = job
+    return worker_router.maze_route(a, b, worker_layout, worker_usage.counts, worker_usage.keepout, window_margin=window_margin, corridor=corridor)
@@ -0,0 +1,140 @@
+from __future__ import print_function
+
+import numpy as np
+from scipy.spatial.distance import pdist
+
+class UnionFind(object):
+    """
+    Disjoint sets of the integers [0, size), with path halving and union by
+    size.
+    """
+    def __init__(self, size):
+        self.parent = range(size)
+        self.size = [1] * size
+
+    def find(self, u):
+        parent = self.parent
+        while parent[u] != u:
+            parent[u] = parent[parent[u]]
+            u = parent[u]
+        return u
+
+    def union(self, u, v):
+        """
+        Merge the sets holding u and v. Returns False if they were already
+        the same set.
+        """
+        u = self.find(u)
+        v = self.find(v)
+        if u == v:
+            return False
+
+        if self.size[u] < self.size[v]:
+            u, v = v, u
+        self.parent[v] = u
+        self.size[u] += self.size[v]
+
+        return True
+
+def minimum_spanning_tree(coords):
+    """
+    Returns the (i, j) pairs, i < j, of a rectilinear minimum spanning tree
+    of coords (an N x 3 array), using Kruskal's algorithm.
+    """
+    n = len(coords)
+    if n < 2:
+        return []
+
+    # pdist orders the pairs (0, 1), (0, 2), ..., (1, 2), ...
+    distances = pdist(coords, "cityblock")
+    first, second = np.triu_indices(n, 1)
+    order = np.argsort(distances, kind="mergesort")
+
+    sets = UnionFind(n)
+    tree = []
+    for u, v in zip(first[order].tolist(), second[order].tolist()):
+        if sets.union(u, v):
+            tree.append((u, v))
+            if len(tree) == n - 1:
+                break
+
+    return tree
+
+def rectilinear_steiner_tree(coords, allowed=None):
+    """
+    Returns Steiner points (a K x 3 array) and the (i, j) pairs of a
+    rectilinear Steiner tree connecting coords (an N x 3 array), where
+    indices from N onwards are the Steiner points.
+
+    Steiner points are found in rounds, starting from the minimum spanning
+    tree. Every two edges (u, w) and (w, v) of the tree meeting at w
+    propose the median of u, v and w, which joins the three of them with
+    less wire than the two edges whenever it isn't w itself. The proposals
+    saving the most wire, that don't share an edge and for which
+    allowed((y, z, x)) (if given) is True, are added, and the tree is
+    rebuilt with them. Steiner points left with fewer than three neighbours
+    are dropped at the end.
+    """
+    points = np.array(coords, dtype=np.int).reshape((-1, 3))
+    n = len(points)
+    known = set(map(tuple, points.tolist()))
+
+    while True:
+        tree = minimum_spanning_tree(points)
+
+        # Every pair of edges meeting at a point
+        neighbours = [[] for _ in xrange(len(points))]
+        for u, v in tree:
+            neighbours[u].append(v)
+            neighbours[v].append(u)
+
+        triples = []
+        for w, adjacent in enumerate(neighbours):
+            for k, u in enumerate(adjacent):
+                for v in adjacent[k+1:]:
+                    triples.append((u, w, v))
+        if len(triples) == 0:
+            break
+
+        u, w, v = np.array(triples, dtype=np.int).T
+        medians = np.sort(np.array([points[u], points[w], points[v]]), axis=0)[1]
+
+        def distance(p, q):
+            return np.abs(p - q).sum(axis=1)
+
+        gains = distance(points[u], points[w]) + distance(points[w], points[v]) \
+            - distance(medians, points[u]) - distance(medians, points[v]) - distance(medians, points[w])
+
+        used = set()
+        added = []
+        for k in np.argsort(-gains, kind="mergesort").tolist():
+            if gains[k] <= 0:
+                break
+
+            median = tuple(medians[k].tolist())
+            edges = [(min(u[k], w[k]), max(u[k], w[k])), (min(w[k], v[k]), max(w[k], v[k]))]
+            if median in known or any(edge in used for edge in edges):
+                continue
+            if allowed is not None and not allowed(median):
+                continue
+
+            used.update(edges)
+            known.add(median)
+            added.append(median)
+
+        if len(added) == 0:
+            break
+
+        points = np.concatenate([points, np.array(added, dtype=np.int)])
+
+    # Drop Steiner points that don't join at least three others
+    while len(points) > n:
+        degrees = np.bincount(np.array(tree, dtype=np.int).ravel(), minlength=len(points))
+        useless = np.flatnonzero(degrees[n:] < 3) + n
+        if len(useless) == 0:
+            break
+
+        points = np.delete(points, useless, axis=0)
+        tree = minimum_spanning_tree(points)
+
+    return points[n:], tree
@@ -0,0 +1,58 @@
+from __future__ import print_function
+
+import random
+
+import pytest
+
+from bucketqueue import BucketQueue
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_reference(seed):
+    """
+    Check pops against a dictionary of the lowest priority each item was
+    pushed with. Items of equal priority may come out in any order.
+    """
+    rng = random.Random(seed)
+    queue = BucketQueue(size=8)
+    expected = {}
+    last = 0
+
+    for _ in xrange(2000):
+        if expected and rng.random() < 0.4:
+            item, priority = queue.pop()
+
+            assert priority == min(expected.itervalues())
+            assert expected.pop(item) == priority
+            last = priority
+        else:
+            # Far enough ahead to go through the overflow, with repeats
+            # and decreases of items already in the queue
+            item = rng.randrange(40)
+            priority = last + rng.randrange(30)
+            queue.push(item, priority)
+            expected[item] = min(priority, expected.get(item, priority))
+
+        assert len(queue) == len(expected)
+
+    while expected:
+        item, priority = queue.pop()
+        assert priority == min(expected.itervalues())
+        assert expected.pop(item) == priority
+
+def test_push_below_popped():
+    queue = BucketQueue()
+    queue.push("a", 5)
+    queue.pop()
+
+    with pytest.raises(ValueError):
+        queue.push("b", 4)
+
+def test_pop_empty():
+    queue = BucketQueue()
+    with pytest.raises(IndexError):
+        queue.pop()
+
+    queue.push("a", 1000)
+    queue.pop()
+    with pytest.raises(IndexError):
+        queue.pop()
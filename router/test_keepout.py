@@ -0,0 +1,84 @@
+from __future__ import print_function
+
+import itertools
+
+import numpy as np
+import pytest
+
+from keepout import KeepOut
+
+def random_usage(seed, shape=(6, 10, 12), density=0.2):
+    return np.random.RandomState(seed).random_sample(shape) < density
+
+def brute_force_counts(usage):
+    """
+    Count, for every location, the locations in use on its stencil.
+    """
+    counts = np.zeros(usage.shape, dtype=np.int)
+    for coord in itertools.product(*map(xrange, usage.shape)):
+        for offset in KeepOut.stencil:
+            neighbour = tuple(c + d for c, d in zip(coord, offset))
+            if all(0 <= c < n for c, n in zip(neighbour, usage.shape)) and usage[neighbour]:
+                counts[coord] += 1
+    return counts
+
+def brute_force_conflicts(usage, coord, a, b):
+    """
+    Count the locations in use other than a and b on the stencil of coord.
+    """
+    if coord == a or coord == b:
+        return 0
+
+    count = 0
+    for offset in KeepOut.stencil:
+        neighbour = tuple(c + d for c, d in zip(coord, offset))
+        if neighbour in (a, b):
+            continue
+        if all(0 <= c < n for c, n in zip(neighbour, usage.shape)) and usage[neighbour]:
+            count += 1
+    return count
+
+@pytest.mark.parametrize("seed", range(3))
+def test_counts(seed):
+    usage = random_usage(seed)
+    keepout = KeepOut(usage)
+
+    assert (keepout.counts == brute_force_counts(usage)).all()
+
+@pytest.mark.parametrize("seed", range(3))
+def test_add_and_remove(seed):
+    rng = np.random.RandomState(seed)
+    usage = random_usage(seed)
+    keepout = KeepOut(usage)
+
+    for _ in xrange(20):
+        # Repeated and already used locations included
+        locations = rng.randint(usage.size, size=15)
+        if rng.random_sample() < 0.5:
+            keepout.add(locations)
+            usage.flat[locations] = True
+        else:
+            keepout.remove(locations)
+            usage.flat[locations] = False
+
+        fresh = KeepOut(usage)
+        assert (keepout.usage == fresh.usage).all()
+        assert (keepout.counts == fresh.counts).all()
+
+@pytest.mark.parametrize("seed", range(3))
+def test_conflicts(seed):
+    rng = np.random.RandomState(seed)
+    usage = random_usage(seed)
+    keepout = KeepOut(usage)
+
+    coords = [tuple(coord) for coord in np.argwhere(np.ones(usage.shape, dtype=np.bool)).tolist()]
+    for _ in xrange(10):
+        # Pins are locations in use, beside the wire or not
+        a = tuple(np.argwhere(usage)[rng.randint(usage.sum())].tolist())
+        b = tuple(np.argwhere(usage)[rng.randint(usage.sum())].tolist())
+
+        expected = [brute_force_conflicts(usage, coord, a, b) for coord in coords]
+
+        assert [keepout.conflicts(coord, a, b) for coord in coords] == expected
+        assert keepout.count_conflicts(coords, a, b).tolist() == expected
+        assert [keepout.violating(coord, a, b) for coord in coords] == [count > 0 for count in expected]
@@ -0,0 +1,38 @@
+from __future__ import print_function
+
+import random
+
+import numpy as np
+import pytest
+
+from keepout import KeepOut
+from router import Router
+
+def random_search(rng, shape):
+    """
+    Returns random blocks of the given shape, their KeepOut, and two free
+    locations on the wire levels (every third Y) to route between.
+    """
+    blocks = np.zeros(shape, dtype=np.int)
+    blocks[np.random.RandomState(rng.randrange(2**31)).random_sample(shape) < 0.1] = 1
+
+    height, width, length = shape
+    a = (3 * rng.randrange((height + 2) // 3), rng.randrange(width), rng.randrange(length))
+    b = (3 * rng.randrange((height + 2) // 3), rng.randrange(width), rng.randrange(length))
+    blocks[a] = 0
+    blocks[b] = 0
+
+    return blocks, KeepOut(blocks), a, b
+
+@pytest.mark.parametrize("astar", [True, False])
+def test_reused_search_state(astar):
+    rng = random.Random(0)
+    router = Router(None, {})
+
+    # Change shape part of the way through, so the state is made again
+    for shape in [(6, 12, 12)] * 15 + [(4, 9, 14)] * 15:
+        blocks, keepout, a, b = random_search(rng, shape)
+        window = ((0, 0, 0), shape)
+
+        expected = Router(None, {}).maze_search(a, b, blocks, keepout, window, astar)
+        assert router.maze_search(a, b, blocks, keepout, window, astar) == expected
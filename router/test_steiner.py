@@ -0,0 +1,71 @@
+from __future__ import print_function
+
+import random
+
+import numpy as np
+import pytest
+from scipy.sparse.csgraph import minimum_spanning_tree as scipy_minimum_spanning_tree
+from scipy.spatial.distance import cdist
+
+from steiner import UnionFind, minimum_spanning_tree, rectilinear_steiner_tree
+
+def random_coords(seed, n):
+    """
+    Returns n distinct random (y, z, x), as an N x 3 array.
+    """
+    rng = random.Random(seed)
+    coords = set()
+    while len(coords) < n:
+        coords.add((3 * rng.randrange(4), rng.randrange(30), rng.randrange(30)))
+    return np.array(sorted(coords), dtype=np.int)
+
+def tree_length(points, tree):
+    return sum(np.abs(points[u] - points[v]).sum() for u, v in tree)
+
+def is_spanning_tree(num_points, tree):
+    sets = UnionFind(num_points)
+    return len(tree) == num_points - 1 and all(sets.union(u, v) for u, v in tree)
+
+@pytest.mark.parametrize("seed", range(10))
+def test_minimum_spanning_tree(seed):
+    coords = random_coords(seed, 2 + seed * 3)
+    tree = minimum_spanning_tree(coords)
+
+    assert all(u < v for u, v in tree)
+    assert is_spanning_tree(len(coords), tree)
+
+    distances = cdist(coords, coords, "cityblock")
+    assert tree_length(coords, tree) == scipy_minimum_spanning_tree(distances).data.sum()
+
+@pytest.mark.parametrize("seed", range(10))
+def test_steiner_tree(seed):
+    coords = random_coords(seed, 2 + seed * 3)
+    steiner_points, tree = rectilinear_steiner_tree(coords)
+    points = np.concatenate([coords, steiner_points.reshape((-1, 3))])
+
+    assert is_spanning_tree(len(points), tree)
+    assert tree_length(points, tree) <= tree_length(coords, minimum_spanning_tree(coords))
+
+    # Every Steiner point is new, and joins at least three others
+    assert not set(map(tuple, steiner_points.tolist())) & set(map(tuple, coords.tolist()))
+    degrees = np.bincount(np.array(tree, dtype=np.int).ravel(), minlength=len(points))
+    assert (degrees[len(coords):] >= 3).all()
+
+@pytest.mark.parametrize("seed", range(10))
+def test_steiner_points_allowed(seed):
+    coords = random_coords(seed, 2 + seed * 3)
+
+    def allowed(coord):
+        y, z, x = coord
+        return (z + x) % 2 == 0
+
+    steiner_points, tree = rectilinear_steiner_tree(coords, allowed)
+
+    assert all(allowed(point) for point in steiner_points.tolist())
+    assert is_spanning_tree(len(coords) + len(steiner_points), tree)
+
+def test_single_point():
+    steiner_points, tree = rectilinear_steiner_tree([(0, 1, 2)])
+
+    assert len(steiner_points) == 0
+    assert tree == []
@@ -0,0 +1,57 @@
+from __future__ import print_function
+
+import numpy as np
+import pytest
+
+from keepout import KeepOut
+from usage import UsageGrid
+
+def random_wires(rng, blocks, count):
+    """
+    Returns count random wires over blocks, each an array of distinct flat
+    indices, overlapping each other and the blocks.
+    """
+    return [rng.choice(blocks.size, size=rng.randint(1, 30), replace=False) for _ in xrange(count)]
+
+def assert_matches(grid, blocks, wires):
+    expected = (blocks != 0).astype(np.int)
+    for wire in wires:
+        expected.flat[wire] += 1
+
+    fresh = KeepOut(expected)
+    assert (grid.counts == expected).all()
+    assert (grid.keepout.usage == fresh.usage).all()
+    assert (grid.keepout.counts == fresh.counts).all()
+
+@pytest.mark.parametrize("seed", range(3))
+def test_rip_up_everything(seed):
+    rng = np.random.RandomState(seed)
+    blocks = (rng.random_sample((6, 10, 12)) < 0.1).astype(np.int)
+    grid = UsageGrid(blocks)
+
+    wires = random_wires(rng, blocks, 20)
+    for k, wire in enumerate(wires):
+        grid.add(wire)
+        assert_matches(grid, blocks, wires[:k+1])
+
+    # Rip them up in another order than they went down
+    order = rng.permutation(len(wires)).tolist()
+    for j, k in enumerate(order):
+        grid.remove(wires[k])
+        assert_matches(grid, blocks, [wires[m] for m in order[j+1:]])
+
+    assert (grid.counts == (blocks != 0)).all()
+
+def test_shared():
+    rng = np.random.RandomState(0)
+    blocks = (rng.random_sample((6, 10, 12)) < 0.1).astype(np.int)
+    grid = UsageGrid(blocks)
+
+    shape, buffers = grid.share()
+    other = UsageGrid.from_shared(shape, buffers)
+
+    wires = random_wires(rng, blocks, 5)
+    for wire in wires:
+        other.add(wire)
+
+    assert_matches(grid, blocks, wires)
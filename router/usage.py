@@ -0,0 +1,76 @@
+from __future__ import print_function
+
+import ctypes
+import numpy as np
+from multiprocessing.sharedctypes import RawArray
+
+from keepout import KeepOut
+
+class UsageGrid(object):
+    """
+    UsageGrid counts how many things occupy each location of a layout:
+    one for a block of a placed cell, plus one for every routed segment
+    whose wire (or the stone under it) is there.
+
+    Segments are added as they are routed and removed as they are ripped
+    up, so the counts always match the current routing, and the KeepOut of
+    the occupied locations is kept up to date along with them.
+    """
+    def __init__(self, blocks):
+        self.counts = (blocks != 0).astype(np.int32)
+        self.keepout = KeepOut(self.counts)
+
+    def share(self):
+        """
+        Move the counts, along with those of the KeepOut, into shared
+        memory, so that processes forked afterwards see every change made
+        to this grid.
+
+        Returns the shape and buffers to pass to from_shared().
+        """
+        buffers = []
+        arrays = []
+        for array, ctype in [(self.counts, ctypes.c_int32), (self.keepout.usage, ctypes.c_bool), (self.keepout.counts, ctypes.c_int32)]:
+            buffer = RawArray(ctype, array.size)
+            shared = np.frombuffer(buffer, dtype=array.dtype).reshape(array.shape)
+            shared[...] = array
+            buffers.append(buffer)
+            arrays.append(shared)
+
+        self.counts, self.keepout.usage, self.keepout.counts = arrays
+
+        return self.counts.shape, buffers
+
+    @classmethod
+    def from_shared(cls, shape, buffers):
+        """
+        Returns a UsageGrid backed by the buffers from share().
+        """
+        counts, usage, keepout_counts = [np.frombuffer(buffer, dtype=dtype).reshape(shape) for buffer, dtype in zip(buffers, [np.int32, np.bool, np.int32])]
+
+        grid = cls.__new__(cls)
+        grid.counts = counts
+        grid.keepout = KeepOut.__new__(KeepOut)
+        grid.keepout.usage = usage
+        grid.keepout.counts = keepout_counts
+
+        return grid
+
+    def add(self, wire):
+        """
+        Add a segment's wire, an array of distinct flat indices into the
+        layout.
+        """
+        self.counts.flat[wire] += 1
+
+        newly_used = wire[self.counts.flat[wire] == 1]
+        self.keepout.add(newly_used)
+
+    def remove(self, wire):
+        """
+        Remove a segment's wire, previously added with add().
+        """
+        self.counts.flat[wire] -= 1
+
+        unused = wire[self.counts.flat[wire] == 0]
+        self.keepout.remove(unused)